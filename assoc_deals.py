@@ -1,11 +1,24 @@
 from dotenv import load_dotenv
-import time
+import argparse
+from pathlib import Path
 import os
 import sys
+import threading
 from functions.logger import log, output_logs
-from functions.parse_csv import parse_csv
-from functions.search_records import SearchBody, search_records
+from functions.parse_csv import stream_csv, chunked
 from functions.associate_records import associate_records
+from functions.id_index import IdIndex
+from functions.resolve_ids import resolve_ids
+from functions.journal import Journal
+from functions.hubspot_client import pool_stats
+from functions.metrics import output_metrics
+from functions.dead_letter import output_dead_letters
+from functions.pipeline import Pipeline
+from functions.shard import apply_shard, parse_shard, shard_suffix
+from functions.reconciliation import Reconciliation, failure_bucket
+from functions.delta_sync import DeltaState, DeltaSync
+from functions.existing_associations import archive_associations, read_associations
+from functions.association_cache import get_association_cache
 
 load_dotenv()
 PRIVATE_APP_KEY = os.getenv("PRIVATE_APP_KEY")
@@ -14,127 +27,225 @@ COMPANY_EXT_ID = os.getenv("COMPANY_EXT_ID")
 DEAL_EXT_ID = os.getenv("DEAL_EXT_ID")
 DEAL_TO_COMPANY_PROP = os.getenv("DEAL_TO_COMPANY_PROP")
 DEAL_TO_CONTACT_PROP = os.getenv("DEAL_TO_CONTACT_PROP")
+WORKERS = int(os.getenv("WORKERS") or 1)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE") or 1000)
 if not PRIVATE_APP_KEY or not CONTACT_EXT_ID or not COMPANY_EXT_ID or not DEAL_EXT_ID or not DEAL_TO_COMPANY_PROP or not DEAL_TO_CONTACT_PROP:
-    log("Error: Missing required environment variable(s).")
+    log("Error: Missing required environment variable(s).", "error")
     sys.exit()
 
-source_file_name = sys.argv[1] if len(sys.argv) > 1 else "deals.csv"
+parser = argparse.ArgumentParser(description="Associate HubSpot deals to their companies and contacts")
+parser.add_argument("source_file_name", nargs="?", default="deals.csv")
+parser.add_argument("--resume", action="store_true", help="skip associations recorded by a previous run")
+parser.add_argument("--delta", action="store_true", help="only associate deals that are new or changed since the last --delta run")
+parser.add_argument("--diff", action="store_true", help="read the deals' existing associations (cached locally) and only send the missing ones")
+parser.add_argument("--archive-stale", action="store_true", help="with --diff, also archive company and contact associations the export no longer has")
+parser.add_argument("--shard", type=parse_shard, help="run as shard i/N of a sharded run (see run_sharded.py), with 1/N of the rate limit")
+args = parser.parse_args()
+source_file_name = args.source_file_name
 if not source_file_name:
-    log("Error: Source file name not provided as argument.")
+    log("Error: Source file name not provided as argument.", "error")
     sys.exit()
 
-ext_deals: list[dict] = parse_csv(f"data/{source_file_name}")
-
-# Get Deals from HubSpot
-hs_deals = []
-for i in range(0, len(ext_deals), 100):
-    log(f"batch {i//100 + 1}/{len(ext_deals)//100 + 1}")
-    batch = ext_deals[i:i+100]
-    ext_deal_ids = list(set([record["Id"] for record in batch]))
-    deal_search_body: SearchBody = {
-        "filterGroups": [{
-            "filters": [{
-                "propertyName": DEAL_EXT_ID,
-                "operator": "IN",
-                "values": ext_deal_ids
-            }]
-        }],
-        "limit": 100,
-        "properties": [DEAL_EXT_ID]
-    }
-    these_deals = search_records("deals", deal_search_body, PRIVATE_APP_KEY)
-    hs_deals.extend(these_deals)
-    time.sleep(0.25)
-
-# Add HubSpot Deal IDs to ext_deals
-for ext_deal in ext_deals:
-    for hs_deal in hs_deals:
-        if hs_deal["properties"][DEAL_EXT_ID] == ext_deal["Id"]:
-            ext_deal["hs_id"] = hs_deal["id"]
-            break
-
-# Get Companies from HubSpot
-ext_deals_with_companies = [deal for deal in ext_deals if deal.get('AccountId')]
-hs_companies = []
-for i in range(0, len(ext_deals_with_companies), 100):
-    log(f"batch {i//100 + 1}/{len(ext_deals_with_companies)//100 + 1}")
-    batch = ext_deals_with_companies[i:i+100]
-    ext_company_ids = list(set([deal[DEAL_TO_COMPANY_PROP] for deal in batch]))
-    company_search_body: SearchBody = {
-        "filterGroups": [{
-            "filters": [{
-                "propertyName": COMPANY_EXT_ID,
-                "operator": "IN",
-                "values": ext_company_ids
-            }]
-        }],
-        "limit": 100,
-        "properties": [COMPANY_EXT_ID]
-    }
-    these_companies = search_records("companies", company_search_body, PRIVATE_APP_KEY)
-    hs_companies.extend(these_companies)
-    time.sleep(0.25)
-
-# Add HubSpot Company IDs to ext_deals
-for ext_deal in ext_deals_with_companies:
-    for company in hs_companies:
-        if company["properties"][COMPANY_EXT_ID] == ext_deal[DEAL_TO_COMPANY_PROP]:
-            ext_deal["company_hs_id"] = company["id"]
-            break
-
-# Associate Companies
-company_associations = [deal for deal in ext_deals_with_companies if deal.get('hs_id') and deal.get('company_hs_id')]
-associate_records(
-   "deals",
-   "hs_id",
-   "companies",
-   "company_hs_id",
-   "HUBSPOT_DEFINED",
-   5,
-   company_associations,
-   PRIVATE_APP_KEY
-)
+if args.archive_stale:
+    args.diff = True
+
+id_index = IdIndex()
+apply_shard(args.shard)
+journal = Journal(f"assoc_deals_{Path(source_file_name).name}", args.resume)
+report = Reconciliation(f"assoc_deals{shard_suffix(args.shard)}")
+
+COMPANY_ASSOCIATION_TYPE = 5
+CONTACT_ASSOCIATION_TYPE = 3
+diff_counts = { "already_associated": 0, "stale": 0 }
+diff_counts_lock = threading.Lock()
+
+# Specific to Salesforce, modify as needed
+MODIFIED_FIELD = "LastModifiedDate"
+delta = None
+if args.delta:
+    # Only the columns that decide the associations, so renaming a deal doesn't resend them
+    delta = DeltaSync(DeltaState(), "deal_associations", "Id", MODIFIED_FIELD, ["Id", DEAL_TO_COMPANY_PROP, DEAL_TO_CONTACT_PROP], f"deal_associations{shard_suffix(args.shard)}")
+
+def resolve_records(ext_deals: list[dict]) -> list[dict]:
+    # Get Deals from HubSpot
+    resolve_ids("deals", DEAL_EXT_ID, [deal["Id"] for deal in ext_deals], PRIVATE_APP_KEY, id_index)
+
+    # Get Companies from HubSpot
+    resolve_ids("companies", COMPANY_EXT_ID, [deal[DEAL_TO_COMPANY_PROP] for deal in ext_deals if deal.get(DEAL_TO_COMPANY_PROP)], PRIVATE_APP_KEY, id_index)
+
+    # Get Contacts from HubSpot
+    resolve_ids("contacts", CONTACT_EXT_ID, [deal[DEAL_TO_CONTACT_PROP] for deal in ext_deals if deal.get(DEAL_TO_CONTACT_PROP)], PRIVATE_APP_KEY, id_index)
+
+    # Get the deals' existing associations, left unset for deals whose associations couldn't be read
+    if args.diff:
+        deal_ids = [id_index.get("deals", deal["Id"]) for deal in ext_deals]
+        companies = read_associations("deals", "companies", deal_ids, PRIVATE_APP_KEY, WORKERS)
+        contacts = read_associations("deals", "contacts", deal_ids, PRIVATE_APP_KEY, WORKERS)
+        for deal, deal_id in zip(ext_deals, deal_ids):
+            if deal_id in companies:
+                deal["existing_companies"] = companies[deal_id]
+            if deal_id in contacts:
+                deal["existing_contacts"] = contacts[deal_id]
+    return ext_deals
+
+def already_associated(deal: dict, existing_field: str, to_id: str, association_type_id: int) -> bool:
+    if association_type_id in deal.get(existing_field, {}).get(to_id, ()):
+        diff_counts["already_associated"] += 1
+        return True
+    return False
+
+def stale_associations(deal: dict, existing_field: str, source_field: str, to_id_field: str, association_type_id: int) -> list[dict]:
+    # Only when the export has no value or one that resolved, so an unresolved ID doesn't archive the right association
+    existing = deal.get(existing_field)
+    if existing is None or (deal.get(source_field) and not deal.get(to_id_field)):
+        return []
+    return [
+        { "Id": deal["Id"], "hs_id": deal["hs_id"], "stale_hs_id": to_id }
+        for to_id, type_ids in existing.items()
+        if association_type_id in type_ids and to_id != deal.get(to_id_field)
+    ]
+
+def build_associations(ext_deals: list[dict]) -> tuple[list[dict], list[dict], list[dict], list[dict], list[dict]]:
+    # Add HubSpot IDs to ext_deals
+    for ext_deal in ext_deals:
+        hs_id = id_index.get("deals", ext_deal["Id"])
+        if hs_id:
+            ext_deal["hs_id"] = hs_id
+        company_hs_id = ext_deal.get(DEAL_TO_COMPANY_PROP) and id_index.get("companies", ext_deal[DEAL_TO_COMPANY_PROP])
+        if company_hs_id:
+            ext_deal["company_hs_id"] = company_hs_id
+        contact_hs_id = ext_deal.get(DEAL_TO_CONTACT_PROP) and id_index.get("contacts", ext_deal[DEAL_TO_CONTACT_PROP])
+        if contact_hs_id:
+            ext_deal["contact_hs_id"] = contact_hs_id
+
+        # Unmatched deals, companies and contacts
+        if not hs_id:
+            report.add("skipped_no_parent", [ext_deal["Id"]], f"No HubSpot deal found for {ext_deal['Id']}")
+            continue
+        if ext_deal.get(DEAL_TO_COMPANY_PROP) and not company_hs_id:
+            report.add("skipped_no_parent", [ext_deal["Id"]], f"No HubSpot company found for {ext_deal[DEAL_TO_COMPANY_PROP]}")
+        if ext_deal.get(DEAL_TO_CONTACT_PROP) and not contact_hs_id:
+            report.add("skipped_no_parent", [ext_deal["Id"]], f"No HubSpot contact found for {ext_deal[DEAL_TO_CONTACT_PROP]}")
+        if not company_hs_id and not contact_hs_id and not ext_deal.get(DEAL_TO_COMPANY_PROP) and not ext_deal.get(DEAL_TO_CONTACT_PROP):
+            report.add("imported", [ext_deal["Id"]], "Nothing to associate")
 
-# Get Contacts from HubSpot
-ext_deals_with_contacts = [deal for deal in ext_deals if deal.get('ContactId')]
-hs_contacts = []
-for i in range(0, len(ext_deals_with_contacts), 100):
-    log(f"batch {i//100 + 1}/{len(ext_deals_with_contacts)//100 + 1}")
-    batch = ext_deals_with_contacts[i:i+100]
-    ext_contact_ids = list(set([deal[DEAL_TO_CONTACT_PROP] for deal in batch]))
-    contact_search_body: SearchBody = {
-        "filterGroups": [{
-            "filters": [{
-                "propertyName": CONTACT_EXT_ID,
-                "operator": "IN",
-                "values": ext_contact_ids
-            }]
-        }],
-        "limit": 100,
-        "properties": [CONTACT_EXT_ID]
-    }
-    these_contacts = search_records("contacts", contact_search_body, PRIVATE_APP_KEY)
-    hs_contacts.extend(these_contacts)
-    time.sleep(0.25)
-
-# Add HubSpot Contact IDs to ext_deals
-for deal in ext_deals_with_contacts:
-    for contact in hs_contacts:
-        if contact["properties"][CONTACT_EXT_ID] == deal[DEAL_TO_CONTACT_PROP]:
-            deal["contact_hs_id"] = contact["id"]
-            break
-
-# Associate Contacts
-contact_associations = [deal for deal in ext_deals_with_contacts if deal.get('hs_id') and deal.get('contact_hs_id')]
-associate_records(
-   "deals",
-   "hs_id",
-   "contacts",
-   "contact_hs_id",
-   "HUBSPOT_DEFINED",
-   3,
-   contact_associations,
-   PRIVATE_APP_KEY
+    company_associations = []
+    contact_associations = []
+    stale_companies = []
+    stale_contacts = []
+    for deal in ext_deals:
+        if not deal.get('hs_id'):
+            continue
+        if deal.get('company_hs_id'):
+            if journal.done("company", f"{deal['hs_id']}:{deal['company_hs_id']}"):
+                report.add("imported", [deal["Id"]], "Company associated by a previous run")
+            elif already_associated(deal, "existing_companies", deal["company_hs_id"], COMPANY_ASSOCIATION_TYPE):
+                report.add("imported", [deal["Id"]], "Company already associated in HubSpot")
+            else:
+                company_associations.append(deal)
+        if deal.get('contact_hs_id'):
+            if journal.done("contact", f"{deal['hs_id']}:{deal['contact_hs_id']}"):
+                report.add("imported", [deal["Id"]], "Contact associated by a previous run")
+            elif already_associated(deal, "existing_contacts", deal["contact_hs_id"], CONTACT_ASSOCIATION_TYPE):
+                report.add("imported", [deal["Id"]], "Contact already associated in HubSpot")
+            else:
+                contact_associations.append(deal)
+        if args.archive_stale:
+            stale_companies.extend(stale_associations(deal, "existing_companies", DEAL_TO_COMPANY_PROP, "company_hs_id", COMPANY_ASSOCIATION_TYPE))
+            stale_contacts.extend(stale_associations(deal, "existing_contacts", DEAL_TO_CONTACT_PROP, "contact_hs_id", CONTACT_ASSOCIATION_TYPE))
+    return ext_deals, company_associations, contact_associations, stale_companies, stale_contacts
+
+def record_associated(kind: str, to_record_type: str, to_id_field: str, association_type_id: int, batch: list[dict]):
+    journal.record_many(kind, [(f"{deal['hs_id']}:{deal[to_id_field]}", None) for deal in batch])
+    if args.diff:
+        get_association_cache().add("deals", to_record_type, [(deal["hs_id"], deal[to_id_field], association_type_id) for deal in batch])
+    report.add("imported", [deal["Id"] for deal in batch])
+
+def record_archived(batch: list[dict]):
+    # Counted once archived, so the total leaves out archives that failed
+    with diff_counts_lock:
+        diff_counts["stale"] += len(batch)
+
+def create_associations(chunk: tuple[list[dict], list[dict], list[dict], list[dict], list[dict]]) -> int:
+    ext_deals, company_associations, contact_associations, stale_companies, stale_contacts = chunk
+    failed: set[str] = set()
+
+    def association_failed(kind: str, batch: list[dict], error: str, status: int | None):
+        failed.update(deal["Id"] for deal in batch)
+        report.add(failure_bucket(status), [deal["Id"] for deal in batch], f"{kind} association failed: {error}")
+
+    # Associate Companies
+    associate_records(
+       "deals",
+       "hs_id",
+       "companies",
+       "company_hs_id",
+       "HUBSPOT_DEFINED",
+       COMPANY_ASSOCIATION_TYPE,
+       company_associations,
+       PRIVATE_APP_KEY,
+       WORKERS,
+       lambda batch: record_associated("company", "companies", "company_hs_id", COMPANY_ASSOCIATION_TYPE, batch),
+       lambda batch, error, status: association_failed("Company", batch, error, status)
+    )
+
+    # Associate Contacts
+    associate_records(
+       "deals",
+       "hs_id",
+       "contacts",
+       "contact_hs_id",
+       "HUBSPOT_DEFINED",
+       CONTACT_ASSOCIATION_TYPE,
+       contact_associations,
+       PRIVATE_APP_KEY,
+       WORKERS,
+       lambda batch: record_associated("contact", "contacts", "contact_hs_id", CONTACT_ASSOCIATION_TYPE, batch),
+       lambda batch, error, status: association_failed("Contact", batch, error, status)
+    )
+
+    # Archive associations the export no longer has
+    if stale_companies:
+        archive_associations("deals", "hs_id", "companies", "stale_hs_id", "HUBSPOT_DEFINED", COMPANY_ASSOCIATION_TYPE, stale_companies, PRIVATE_APP_KEY, WORKERS, record_archived,
+            lambda batch, error, status: association_failed("Stale company archive", batch, error, status))
+    if stale_contacts:
+        archive_associations("deals", "hs_id", "contacts", "stale_hs_id", "HUBSPOT_DEFINED", CONTACT_ASSOCIATION_TYPE, stale_contacts, PRIVATE_APP_KEY, WORKERS, record_archived,
+            lambda batch, error, status: association_failed("Stale contact archive", batch, error, status))
+
+    # A deal is only synced once every association it asks for exists
+    if delta:
+        delta.synced(deal["Id"] for deal in ext_deals if deal_complete(deal) and deal["Id"] not in failed)
+    return len(company_associations) + len(contact_associations)
+
+def deal_complete(deal: dict) -> bool:
+    if not deal.get("hs_id"):
+        return False
+    if deal.get(DEAL_TO_COMPANY_PROP) and not deal.get("company_hs_id"):
+        return False
+    return not deal.get(DEAL_TO_CONTACT_PROP) or bool(deal.get("contact_hs_id"))
+
+# Stream the export in chunks, resolving chunk N+1 while chunk N is being associated
+deals = stream_csv(f"data/{source_file_name}")
+if delta:
+    deals = delta.filter(deals, lambda deal_ids: report.add("imported", deal_ids, "Unchanged since the last sync"))
+pipeline = (
+    Pipeline(chunked(deals, CHUNK_SIZE))
+    .stage("resolve", resolve_records)
+    .stage("transform", build_associations)
+    .stage("load", create_associations)
 )
+total_associations = sum(pipeline.run())
+journal.close()
+log(f"Total associations sent: {total_associations}")
+if args.diff:
+    log(f"Associations already in HubSpot: {diff_counts['already_associated']}" + (f", stale associations archived: {diff_counts['stale']}" if args.archive_stale else ""))
+if delta:
+    delta.commit()
+
+# Write every deal to the report bucket for its outcome
+report.output(lambda: stream_csv(f"data/{source_file_name}"), "Id")
 
-output_logs("assoc_deals_log")
\ No newline at end of file
+log(f"HTTP connection pool: {pool_stats()}")
+output_dead_letters()
+output_metrics(f"assoc_deals_metrics{shard_suffix(args.shard)}")
+output_logs(f"assoc_deals_log{shard_suffix(args.shard)}")
\ No newline at end of file
@@ -0,0 +1,73 @@
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from functions import serializer
+from generate_data import WORDS
+
+# Encode/decode cost of a batch create payload and its response for each available JSON backend.
+# Usage: python benchmarks/bench_serializer.py --body-kb 200 --batch 100
+
+def make_payload(batch: int, body_kb: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    words = body_kb * 1024 // 8
+    return { "inputs": [
+        {
+            "properties": {
+                "sfdc_id": f"0025g00000{i:08d}AAA",
+                "hs_note_body": " ".join(rng.choices(WORDS, k=words)),
+                "hs_timestamp": "2024-01-01T00:00:00.000Z",
+            },
+            "associations": [{ "types": [{ "associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 214 }], "to": { "id": str(1000 + i) } }],
+        }
+        for i in range(batch)
+    ] }
+
+def make_response(payload: dict) -> dict:
+    # HubSpot echoes every property back, plus timestamps
+    return { "status": "COMPLETE", "results": [
+        { "id": str(5000 + i), "properties": { **input["properties"], "hs_object_id": str(5000 + i) }, "createdAt": "2024-01-01T00:00:00.000Z", "updatedAt": "2024-01-01T00:00:00.000Z", "archived": False }
+        for i, input in enumerate(payload["inputs"])
+    ] }
+
+def backends() -> dict:
+    available = {
+        # What requests does for json= and response.json()
+        "requests default": (lambda data: json.dumps(data).encode("utf-8"), json.loads),
+        "json compact": (lambda data: json.dumps(data, separators=(",", ":")).encode("utf-8"), json.loads),
+    }
+    if serializer.orjson is not None:
+        available["orjson"] = (serializer.orjson.dumps, serializer.orjson.loads)
+    return available
+
+def measure(fn, argument, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(argument)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare JSON backends on batch payloads")
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--body-kb", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = make_payload(args.batch, args.body_kb)
+    response = make_response(payload)
+    if serializer.orjson is None:
+        print("orjson is not installed, only the standard library backends are compared")
+    print(f"{args.batch} records with {args.body_kb} KB bodies, best of {args.repeat}")
+    for name, (dumps, loads) in backends().items():
+        request_body = dumps(payload)
+        response_body = dumps(response)
+        encode = measure(dumps, payload, args.repeat)
+        decode = measure(loads, response_body, args.repeat)
+        project = measure(lambda body: serializer.project_records(loads(body)["results"], ["sfdc_id"]), response_body, args.repeat)
+        print(f"  {name:<17} encode {encode * 1000:8.1f} ms  decode {decode * 1000:8.1f} ms  decode+project {project * 1000:8.1f} ms  request {len(request_body) / 1_000_000:6.1f} MB")
@@ -0,0 +1,55 @@
+import csv
+import os
+import random
+from pathlib import Path
+
+# Synthetic Salesforce-shaped exports for the benchmarks
+
+WORDS = "meeting follow up call contract renewal pricing demo proposal budget timeline onboarding support escalation quote signed".split()
+
+def salesforce_id(prefix: str, number: int) -> str:
+    return f"{prefix}5g00000{number:08d}AAA"
+
+def parent_pools(rows: int) -> dict[str, list[str]]:
+    # Deals match deals.csv one to one, companies and contacts are shared between many rows
+    parents = max(rows // 10, 1)
+    return {
+        "contacts": [salesforce_id("003", i) for i in range(parents)],
+        "companies": [salesforce_id("001", i) for i in range(parents)],
+        "deals": [salesforce_id("006", i) for i in range(rows)],
+    }
+
+def generate_notes(path: Path, rows: int, pools: dict[str, list[str]], seed: int = 0, invalid_rate: float = 0.0):
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(["Id", "ParentId", "Title", "Body", "CreatedDate", "LastModifiedDate"])
+        for i in range(rows):
+            parent_type = rng.choice(["contacts", "companies", "deals"])
+            body = " ".join(rng.choices(WORDS, k=rng.randint(20, 300)))
+            created = f"20{rng.randint(15, 24)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.000+0000"
+            if rng.random() < invalid_rate:
+                # Malformed timestamps that HubSpot rejects, to exercise batch splitting and dead letters
+                created = created.replace("T", " at ")
+            writer.writerow([salesforce_id("002", i), rng.choice(pools[parent_type]), f"Note {i}", body, created, created])
+
+def generate_deals(path: Path, pools: dict[str, list[str]], seed: int = 0):
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(["Id", "Name", "AccountId", "ContactId", "LastModifiedDate"])
+        for i, deal_id in enumerate(pools["deals"]):
+            account_id = rng.choice(pools["companies"]) if rng.random() < 0.8 else ""
+            contact_id = rng.choice(pools["contacts"]) if rng.random() < 0.7 else ""
+            writer.writerow([deal_id, f"Deal {i}", account_id, contact_id, "2024-01-01T00:00:00.000+0000"])
+
+def generate_files(directory: Path, folder_ids: list[str], files_per_folder: int = 2, file_size: int = 64 * 1024, duplicate_rate: float = 0.3, seed: int = 0):
+    # Some files share content across folders, like a contract attached to several deals
+    rng = random.Random(seed)
+    shared = [os.urandom(file_size) for _ in range(10)]
+    for folder_id in folder_ids:
+        folder = directory / folder_id
+        folder.mkdir(parents=True, exist_ok=True)
+        for n in range(files_per_folder):
+            content = rng.choice(shared) if rng.random() < duplicate_rate else rng.randbytes(file_size)
+            (folder / f"attachment_{n}.pdf").write_bytes(content)
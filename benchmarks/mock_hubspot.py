@@ -0,0 +1,375 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the HubSpot endpoints the migration scripts call.
+# Run on its own with `python benchmarks/mock_hubspot.py --port 8765` and point
+# the scripts at it with HUBSPOT_BASE_URL=http://127.0.0.1:8765
+
+SCHEMAS = {
+    "notes": [
+        { "name": "hs_note_body", "type": "string", "fieldType": "html" },
+        { "name": "hs_timestamp", "type": "datetime", "fieldType": "date" },
+        { "name": "hs_attachment_ids", "type": "enumeration", "fieldType": "checkbox", "options": [] },
+    ],
+}
+
+class RateWindow:
+    def __init__(self, max_requests: int, interval: float):
+        self.max_requests = max_requests
+        self.interval = interval
+        self.window_start = time.monotonic()
+        self.count = 0
+
+    def take(self) -> tuple[bool, int]:
+        now = time.monotonic()
+        if now - self.window_start >= self.interval:
+            self.window_start = now
+            self.count = 0
+        if self.max_requests and self.count >= self.max_requests:
+            return False, 0
+        self.count += 1
+        return True, max(self.max_requests - self.count, 0)
+
+class MockHubSpot:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate_limit: tuple[int, float] = (0, 10.0),
+        search_rate_limit: tuple[int, float] = (0, 1.0),
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        unique_properties: tuple[str, ...] = ("sfdc_id",),
+        seed: int = 0,
+    ):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.unique_properties = set(unique_properties)
+        self.random = random.Random(seed)
+        self.window = RateWindow(*rate_limit)
+        self.search_window = RateWindow(*search_rate_limit)
+        self.next_id = 1000
+        self.objects: dict[str, dict[str, dict]] = {}
+        self.by_property: dict[str, dict[str, dict[str, list[str]]]] = {}
+        self.associations: set[tuple[str, str, str, str, int]] = set()
+        self.stats: Counter = Counter()
+        self.uploaded_bytes = 0
+
+    def new_id(self) -> str:
+        self.next_id += 1
+        return str(self.next_id)
+
+    def create(self, object_type: str, properties: dict) -> dict:
+        record_id = self.new_id()
+        self.objects.setdefault(object_type, {})[record_id] = properties
+        for name, value in properties.items():
+            if value:
+                self.by_property.setdefault(object_type, {}).setdefault(name, {}).setdefault(str(value), []).append(record_id)
+        return { "id": record_id, "properties": { **properties, "hs_object_id": record_id } }
+
+    def seed(self, object_type: str, id_property: str, values: list[str]):
+        with self.lock:
+            for value in values:
+                self.create(object_type, { id_property: value })
+
+    def find(self, object_type: str, name: str, value: str) -> list[str]:
+        return self.by_property.get(object_type, {}).get(name, {}).get(str(value), [])
+
+    def record(self, object_type: str, record_id: str, properties: list[str] | None) -> dict:
+        stored = self.objects[object_type][record_id]
+        if properties is not None:
+            stored = { name: stored.get(name) for name in properties }
+        return { "id": record_id, "properties": { **stored, "hs_object_id": record_id } }
+
+    # Endpoint handlers return (status, body)
+
+    def search(self, object_type: str, body: dict) -> tuple[int, dict]:
+        ids: list[str] | None = None
+        for group in body.get("filterGroups", []):
+            for filter in group.get("filters", []):
+                values = filter.get("values") or [filter.get("value")]
+                matched = [record_id for value in values for record_id in self.find(object_type, filter["propertyName"], value)]
+                if ids is None:
+                    ids = matched
+                else:
+                    matched_set = set(matched)
+                    ids = [record_id for record_id in ids if record_id in matched_set]
+        if ids is None:
+            ids = list(self.objects.get(object_type, {}).keys())
+        limit = int(body.get("limit", 10))
+        after = int(body.get("after", 0))
+        page = ids[after:after + limit]
+        response = {
+            "total": len(ids),
+            "results": [self.record(object_type, record_id, body.get("properties")) for record_id in page],
+        }
+        if after + limit < len(ids):
+            response["paging"] = { "next": { "after": str(after + limit) } }
+        return 200, response
+
+    def invalid_inputs(self, inputs: list[dict]) -> tuple[int, dict] | None:
+        # Like HubSpot, one bad value rejects the whole batch
+        for input in inputs:
+            timestamp = input.get("properties", {}).get("hs_timestamp")
+            if timestamp:
+                try:
+                    datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+                except ValueError:
+                    return 400, { "status": "error", "category": "VALIDATION_ERROR", "message": f"Property values were not valid: hs_timestamp {timestamp!r}" }
+        return None
+
+    def batch_create(self, object_type: str, body: dict) -> tuple[int, dict]:
+        if invalid := self.invalid_inputs(body.get("inputs", [])):
+            return invalid
+        results = []
+        for input in body.get("inputs", []):
+            record = self.create(object_type, input.get("properties", {}))
+            for association in input.get("associations", []):
+                for type in association.get("types", []):
+                    self.associations.add((object_type, record["id"], "", association["to"]["id"], type["associationTypeId"]))
+            results.append(record)
+        return 201, { "status": "COMPLETE", "results": results }
+
+    def batch_upsert(self, object_type: str, body: dict) -> tuple[int, dict]:
+        if invalid := self.invalid_inputs(body.get("inputs", [])):
+            return invalid
+        results, errors = [], []
+        for input in body.get("inputs", []):
+            id_property = input.get("idProperty")
+            if id_property not in self.unique_properties:
+                errors.append({ "status": "error", "message": f"{id_property} is not a unique property", "context": { "ids": [input.get("id")] } })
+                continue
+            existing = self.find(object_type, id_property, input["id"])
+            if existing:
+                self.objects[object_type][existing[0]].update(input.get("properties", {}))
+                results.append({ **self.record(object_type, existing[0], None), "new": False })
+            else:
+                results.append({ **self.create(object_type, { **input.get("properties", {}), id_property: input["id"] }), "new": True })
+        response = { "status": "COMPLETE", "results": results }
+        if errors:
+            response["errors"] = errors
+            response["numErrors"] = len(errors)
+        return (207 if errors else 200), response
+
+    def batch_read(self, object_type: str, body: dict) -> tuple[int, dict]:
+        id_property = body.get("idProperty")
+        if id_property and id_property not in self.unique_properties:
+            return 400, { "status": "error", "message": f"{id_property} is not a unique property" }
+        results, errors = [], []
+        for input in body.get("inputs", []):
+            ids = self.find(object_type, id_property, input["id"]) if id_property else ([input["id"]] if input["id"] in self.objects.get(object_type, {}) else [])
+            if ids:
+                results.append(self.record(object_type, ids[0], body.get("properties")))
+            else:
+                errors.append({ "status": "error", "category": "OBJECT_NOT_FOUND", "context": { "ids": [input["id"]] } })
+        response = { "status": "COMPLETE", "results": results }
+        if errors:
+            response["errors"] = errors
+            response["numErrors"] = len(errors)
+        return (207 if errors else 200), response
+
+    def associate(self, from_type: str, to_type: str, body: dict) -> tuple[int, dict]:
+        for input in body.get("inputs", []):
+            if str(input["to"]["id"]) not in self.objects.get(to_type, {}):
+                return 400, { "status": "error", "category": "VALIDATION_ERROR", "message": f"No {to_type} with id {input['to']['id']}" }
+        results = []
+        for input in body.get("inputs", []):
+            for type in input.get("types", []):
+                self.associations.add((from_type, str(input["from"]["id"]), to_type, str(input["to"]["id"]), type["associationTypeId"]))
+            results.append({ "fromObjectId": input["from"]["id"], "toObjectId": input["to"]["id"], "labels": [] })
+        return 201, { "status": "COMPLETE", "results": results }
+
+    def read_associations(self, from_type: str, to_type: str, body: dict) -> tuple[int, dict]:
+        found: dict[str, dict[str, list[int]]] = {}
+        for association_from, from_id, association_to, to_id, type_id in self.associations:
+            if association_from == from_type and association_to == to_type:
+                found.setdefault(from_id, {}).setdefault(to_id, []).append(type_id)
+        results, errors = [], []
+        for input in body.get("inputs", []):
+            from_id = str(input["id"])
+            if from_id in found:
+                results.append({ "from": { "id": from_id }, "to": [
+                    { "toObjectId": int(to_id), "associationTypes": [{ "category": "HUBSPOT_DEFINED", "typeId": type_id, "label": None } for type_id in type_ids] }
+                    for to_id, type_ids in found[from_id].items()
+                ] })
+            else:
+                errors.append({ "status": "error", "category": "OBJECT_NOT_FOUND", "message": f"No {to_type} is associated with {from_type} {from_id}.", "context": { "fromObjectId": [from_id] } })
+        response = { "status": "COMPLETE", "results": results }
+        if errors:
+            response["errors"] = errors
+            response["numErrors"] = len(errors)
+        return (207 if errors else 200), response
+
+    def archive_associations(self, from_type: str, to_type: str, body: dict) -> tuple[int, dict]:
+        for input in body.get("inputs", []):
+            for type in input.get("types", []):
+                self.associations.discard((from_type, str(input["from"]["id"]), to_type, str(input["to"]["id"]), type["associationTypeId"]))
+        return 204, {}
+
+    def create_folder(self, body: dict) -> tuple[int, dict]:
+        return 201, { "id": self.new_id(), "name": body.get("name"), "parentPath": body.get("parentPath") }
+
+    def upload_file(self, head: bytes) -> tuple[int, dict]:
+        match = re.search(rb'name="fileName"\r\n\r\n(.*?)\r\n', head)
+        name = match.group(1).decode() if match else "file"
+        return 201, { "id": self.new_id(), "name": name }
+
+    def schema(self, object_type: str) -> tuple[int, dict]:
+        properties = [*SCHEMAS.get(object_type, []), *[{ "name": name, "type": "string", "fieldType": "text", "hasUniqueValue": True } for name in self.unique_properties]]
+        return 200, { "name": object_type, "properties": properties }
+
+def make_handler(mock: MockHubSpot):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status: int, body: dict, headers: dict | None = None):
+            # 204 responses have no body
+            payload = json.dumps(body).encode() if status != 204 else b""
+            self.send_response(status)
+            if payload:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, str(value))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def read_body(self) -> bytes:
+            # Uploads are drained in chunks and only the multipart head is kept
+            length = int(self.headers.get("Content-Length") or 0)
+            head = b""
+            while length > 0:
+                chunk = self.rfile.read(min(length, 1024 * 1024))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                if len(head) < 64 * 1024:
+                    head += chunk
+                if self.path.startswith("/files/v3/files"):
+                    mock.uploaded_bytes += len(chunk)
+            return head
+
+        def handle_request(self, method: str):
+            raw = self.read_body()
+            path = self.path.split("?")[0]
+            if path.startswith("/__"):
+                return self.admin(method, path, raw)
+
+            is_search = path.endswith("/search")
+            endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", path)
+            with mock.lock:
+                mock.stats[f"{method} {endpoint}"] += 1
+                allowed, remaining = (mock.search_window if is_search else mock.window).take()
+                throttled = not allowed or mock.random.random() < mock.throttle_rate
+                failed = not throttled and mock.random.random() < mock.error_rate
+            if mock.latency:
+                time.sleep(mock.latency)
+            headers = {}
+            if not is_search and mock.window.max_requests:
+                headers = {
+                    "X-HubSpot-RateLimit-Max": mock.window.max_requests,
+                    "X-HubSpot-RateLimit-Remaining": remaining,
+                    "X-HubSpot-RateLimit-Interval-Milliseconds": int(mock.window.interval * 1000),
+                }
+            if throttled:
+                with mock.lock:
+                    mock.stats["429"] += 1
+                return self.send_json(429, { "status": "error", "category": "RATE_LIMITS" }, headers)
+            if failed:
+                with mock.lock:
+                    mock.stats["5xx"] += 1
+                return self.send_json(502, { "status": "error", "message": "Injected server error" }, headers)
+
+            status, body = self.route(method, path, raw)
+            self.send_json(status, body, headers)
+
+        def route(self, method: str, path: str, raw: bytes) -> tuple[int, dict]:
+            with mock.lock:
+                if method == "GET" and (match := re.fullmatch(r"/crm/v3/schemas/(\w+)", path)):
+                    return mock.schema(match.group(1))
+                if method == "GET" and (match := re.fullmatch(r"/crm/v3/properties/(\w+)", path)):
+                    status, schema = mock.schema(match.group(1))
+                    return status, { "results": schema["properties"] }
+                if path == "/files/v3/files":
+                    return mock.upload_file(raw)
+                body = json.loads(raw or b"{}")
+                if match := re.fullmatch(r"/crm/v3/objects/(\w+)/search", path):
+                    return mock.search(match.group(1), body)
+                if match := re.fullmatch(r"/crm/v3/objects/(\w+)/batch/create", path):
+                    return mock.batch_create(match.group(1), body)
+                if match := re.fullmatch(r"/crm/v3/objects/(\w+)/batch/upsert", path):
+                    return mock.batch_upsert(match.group(1), body)
+                if match := re.fullmatch(r"/crm/v3/objects/(\w+)/batch/read", path):
+                    return mock.batch_read(match.group(1), body)
+                if match := re.fullmatch(r"/crm/v4/associations/(\w+)/(\w+)/batch/create", path):
+                    return mock.associate(match.group(1), match.group(2), body)
+                if match := re.fullmatch(r"/crm/v4/associations/(\w+)/(\w+)/batch/read", path):
+                    return mock.read_associations(match.group(1), match.group(2), body)
+                if match := re.fullmatch(r"/crm/v4/associations/(\w+)/(\w+)/batch/labels/archive", path):
+                    return mock.archive_associations(match.group(1), match.group(2), body)
+                if path == "/files/v3/folders":
+                    return mock.create_folder(body)
+            return 404, { "status": "error", "message": f"No mock for {method} {path}" }
+
+        def admin(self, method: str, path: str, raw: bytes):
+            if path == "/__stats":
+                with mock.lock:
+                    stats = { **mock.stats, "uploaded_bytes": mock.uploaded_bytes, "associations": len(mock.associations) }
+                return self.send_json(200, stats)
+            if path == "/__reset_stats":
+                with mock.lock:
+                    mock.stats.clear()
+                    mock.uploaded_bytes = 0
+                return self.send_json(200, {})
+            if path == "/__seed":
+                body = json.loads(raw)
+                mock.seed(body["objectType"], body["idProperty"], body["values"])
+                return self.send_json(200, { "seeded": len(body["values"]) })
+            self.send_json(404, {})
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+    return Handler
+
+def start_server(mock: MockHubSpot, port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_limit(value: str) -> tuple[int, float]:
+    # "100/10" means 100 requests per 10 seconds, "0" disables the limit
+    max_requests, _, interval = value.partition("/")
+    return int(max_requests), float(interval or 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the HubSpot API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--rate-limit", type=parse_limit, default=(0, 10.0), help="e.g. 100/10")
+    parser.add_argument("--search-rate-limit", type=parse_limit, default=(0, 1.0), help="e.g. 5/1")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 502")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    args = parser.parse_args()
+    mock = MockHubSpot(args.latency, args.rate_limit, args.search_rate_limit, args.error_rate, args.throttle_rate)
+    server = start_server(mock, args.port)
+    print(f"Mock HubSpot listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
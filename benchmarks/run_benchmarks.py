@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from generate_data import generate_deals, generate_files, generate_notes, parent_pools
+from mock_hubspot import MockHubSpot, parse_limit, start_server
+
+# End-to-end benchmark of the migration scripts against the local mock.
+# Usage: python benchmarks/run_benchmarks.py --sizes 10000,100000 --latency 0.02
+
+REPO_DIR = Path(__file__).parent.parent
+SCRIPTS = {
+    "migrate_notes": ["migrate_notes.py", "notes.csv"],
+    "assoc_deals": ["assoc_deals.py", "deals.csv"],
+    "migrate_files": ["migrate_files.py", "deals"],
+}
+
+def admin(base_url: str, path: str) -> dict:
+    request = urllib.request.Request(f"{base_url}{path}", method="POST" if path != "/__stats" else "GET", data=b"" if path != "/__stats" else None)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def make_workspace(rows: int, mock: MockHubSpot, seed_fraction: float, invalid_rate: float = 0.0) -> Path:
+    # Same layout the scripts expect: <root>/hubspot-migration, <root>/data, <root>/logs, <root>/files
+    workspace = Path(tempfile.mkdtemp(prefix=f"hubspot_bench_{rows}_"))
+    shutil.copytree(REPO_DIR, workspace / "hubspot-migration", ignore=shutil.ignore_patterns(".git", "__pycache__", "benchmarks", ".env"))
+    for directory in ("data", "logs", "files"):
+        (workspace / directory).mkdir()
+
+    pools = parent_pools(rows)
+    generate_notes(workspace / "data" / "notes.csv", rows, pools, invalid_rate=invalid_rate)
+    generate_deals(workspace / "data" / "deals.csv", pools)
+    generate_files(workspace / "files" / "deals", pools["deals"][:min(max(rows // 100, 1), 2000)])
+
+    # Most, but not all, parents already exist in the portal
+    for object_type, ext_ids in pools.items():
+        mock.seed(object_type, "sfdc_id", ext_ids[:int(len(ext_ids) * seed_fraction)])
+    return workspace
+
+def run_script(workspace: Path, script: str, argument: str, base_url: str, warm_cache: bool) -> dict:
+    if not warm_cache:
+        shutil.rmtree(workspace / "cache", ignore_errors=True)
+    env = {
+        **os.environ,
+        "PRIVATE_APP_KEY": "benchmark",
+        "NOTE_EXT_ID": "sfdc_id",
+        "DEAL_EXT_ID": "sfdc_id",
+        "CONTACT_EXT_ID": "sfdc_id",
+        "COMPANY_EXT_ID": "sfdc_id",
+        "DEAL_TO_COMPANY_PROP": "AccountId",
+        "DEAL_TO_CONTACT_PROP": "ContactId",
+        "HUBSPOT_BASE_URL": base_url,
+    }
+    admin(base_url, "/__reset_stats")
+    started = time.monotonic()
+    with open(workspace / "logs" / f"{Path(script).stem}_stdout.txt", "w") as stdout:
+        process = subprocess.Popen([sys.executable, script, argument], cwd=workspace / "hubspot-migration", env=env, stdout=stdout, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.monotonic() - started
+    stats = admin(base_url, "/__stats")
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_seconds": round(elapsed, 2),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "requests": sum(count for name, count in stats.items() if name.startswith(("GET ", "POST "))),
+        "throttled": stats.get("429", 0),
+        "server_errors": stats.get("5xx", 0),
+        "uploaded_mb": round(stats.get("uploaded_bytes", 0) / 1_000_000, 1),
+        "by_endpoint": { name: count for name, count in stats.items() if name.startswith(("GET ", "POST ")) },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the migration scripts against a local HubSpot mock")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated row counts")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS), help="comma separated script names")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=parse_limit, default=(190, 10.0))
+    parser.add_argument("--search-rate-limit", type=parse_limit, default=(5, 1.0))
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="fraction of notes with values HubSpot rejects")
+    parser.add_argument("--seed-fraction", type=float, default=0.9, help="fraction of parent records that exist in the mock")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the ID cache between scripts")
+    parser.add_argument("--keep", action="store_true", help="keep the generated workspaces")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for rows in [int(size) for size in args.sizes.split(",")]:
+        mock = MockHubSpot(args.latency, args.rate_limit, args.search_rate_limit, args.error_rate, args.throttle_rate)
+        server = start_server(mock)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        workspace = make_workspace(rows, mock, args.seed_fraction, args.invalid_rate)
+        print(f"\n{rows} rows (workspace {workspace})")
+        for name in args.scripts.split(","):
+            script, argument = SCRIPTS[name]
+            result = { "rows": rows, "script": name, **run_script(workspace, script, argument, base_url, args.warm_cache) }
+            results.append(result)
+            print(f"  {name:<14} {result['wall_seconds']:>9.2f}s  {result['peak_rss_mb']:>8.1f} MB  {result['requests']:>8} requests  {result['throttled']:>5} 429s  exit {result['exit_code']}")
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,18 @@
+from dotenv import load_dotenv
+import sys
+from functions.id_cache import get_id_cache
+from functions.property_schema import invalidate_schemas
+
+load_dotenv()
+
+# Pass an object type (e.g. "contacts") to only clear that type, "expired" to drop stale entries,
+# or "schemas" to clear the cached property schemas
+object_type = sys.argv[1] if len(sys.argv) > 1 else None
+
+id_cache = get_id_cache()
+if object_type == "schemas":
+    print(f"Removed {invalidate_schemas()} cached schemas")
+elif object_type == "expired":
+    print(f"Removed {id_cache.purge_expired()} expired cached IDs")
+else:
+    print(f"Removed {id_cache.invalidate(object_type)} cached IDs{f' for {object_type}' if object_type else ''}")
@@ -1,11 +1,30 @@
 import requests
 import time
 from functions.logger import log
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
+from functions.run_batches import run_batches
+from functions.parse_csv import chunked
+from functions.metrics import metrics
+from functions.dead_letter import RECORD_ERROR_STATUSES, SPLIT_FAILURE_BUDGET, dead_letters
+from functions.serializer import response_json
 
-def associate_records(from_record_type, from_id_property, to_record_type, to_id_property, association_category, association_type_id, associations, PRIVATE_APP_KEY):
-   url = f"https://api.hubapi.com/crm/v4/associations/{from_record_type}/{to_record_type}/batch/create"
-   headers = { "Authorization": f"Bearer {PRIVATE_APP_KEY}", "Content-Type": "application/json" }
-   def associate_batch(batch, retry):
+def associate_records(from_record_type, from_id_property, to_record_type, to_id_property, association_category, association_type_id, associations, PRIVATE_APP_KEY, workers=1, on_batch_associated=None, on_batch_failed=None):
+   url = f"{BASE_URL}/crm/v4/associations/{from_record_type}/{to_record_type}/batch/create"
+   kind = f"{from_record_type}_to_{to_record_type}"
+   def failed_associations(batch, context):
+      # The error context lists the from and to IDs of the pairs it rejected
+      from_ids = set(str(id) for id in context.get("fromObjectId") or [])
+      to_ids = set(str(id) for id in context.get("toObjectId") or [])
+      if not from_ids and not to_ids:
+         return []
+      return [
+         assoc for assoc in batch
+         if (not from_ids or str(assoc[from_id_property]) in from_ids) and (not to_ids or str(assoc[to_id_property]) in to_ids)
+      ]
+
+   def send_batch(batch):
+      # Returns the status and error of a request that failed after retries, or None, None
       inputs = []
       for assoc in batch:
          input = {
@@ -18,27 +37,70 @@ def associate_records(from_record_type, from_id_property, to_record_type, to_id_
          }
          inputs.append(input)
       data = { "inputs": inputs }
-      try:
-         response = requests.post(url, headers=headers, json=data)
-         response.raise_for_status()
-         json_response = response.json()
-         log(f"Associated {from_record_type} to {to_record_type}: {len(json_response['results'])}")
-      except requests.exceptions.RequestException as e:
-         if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
-            retry = retry + 1
-            interval = retry * 2
-            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
-            time.sleep(interval)
-            associate_batch(batch, retry)
-         elif retry == 5:
-               log("Max retries reached. Skipping batch.")
-         else:
-               error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-               log(f"Error associating {from_record_type} to {to_record_type}: {error_msg}")
+      retry = 0
+      while True:
+         try:
+            response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=data)
+            response.raise_for_status()
+            json_response = response_json(response)
+            log(f"Associated {from_record_type} to {to_record_type}: {len(json_response['results'])}")
+            # Multi-status responses list the pairs that failed alongside the ones that succeeded
+            failed_pairs = []
+            for error in json_response.get("errors", []):
+               log(f"Error associating {from_record_type} to {to_record_type}: {error.get('message')}", "error", context=error.get("context"))
+               failed = failed_associations(batch, error.get("context") or {})
+               dead_letters.add(kind, failed or [error.get("context")], error.get("message") or "", response.status_code)
+               if failed and on_batch_failed:
+                  # Errors in a multi-status response are rejections of those pairs, like a 400 for a single pair
+                  on_batch_failed(failed, error.get("message") or "", 400)
+               failed_pairs.extend(failed)
+            metrics.record_records(response, len(json_response["results"]))
+            if on_batch_associated:
+               on_batch_associated([assoc for assoc in batch if assoc not in failed_pairs] if failed_pairs else batch)
+            return None, None
+         except requests.exceptions.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and (status == 429 or str(status)[0] == "5") and retry < 5:
+               retry += 1
+               interval = backoff(e.response, retry)
+               log(f"{'Rate limit exceeded' if status == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+               time.sleep(interval)
+               continue
+            if retry == 5:
+               log(f"Max retries reached. Dead-lettering {len(batch)} {kind} associations.", "error")
+            error_msg = e.response.text if e.response is not None and e.response.text else str(e)
+            return status, error_msg
+
+   def fail_batch(batch, status, error_msg, budget):
+      if status in RECORD_ERROR_STATUSES and len(batch) > 1 and budget[0] > 0:
+         # One bad pair fails the whole batch, so keep halving it until the bad pairs are on their own
+         log(f"Error associating {from_record_type} to {to_record_type}, splitting batch of {len(batch)}: {error_msg}", "warning")
+         middle = len(batch) // 2
+         halves = [batch[:middle], batch[middle:]]
+         attempts = [send_batch(half) for half in halves]
+         budget[0] -= sum(1 for attempt in attempts if attempt[1] is not None)
+         for half, (half_status, half_error) in zip(halves, attempts):
+            if half_error is not None:
+               fail_batch(half, half_status, half_error, budget)
+         return
+      if status in RECORD_ERROR_STATUSES and len(batch) > 1:
+         log(f"Split failure budget used up, dead-lettering {len(batch)} {kind} associations without splitting further", "warning")
+      log(f"Error associating {from_record_type} to {to_record_type}: {error_msg}", "error")
+      dead_letters.add(kind, batch, error_msg, status)
+      if on_batch_failed:
+         on_batch_failed(batch, error_msg, status)
+
+   def associate_batch(batch):
+      status, error_msg = send_batch(batch)
+      if error_msg is not None:
+         fail_batch(batch, status, error_msg, [SPLIT_FAILURE_BUDGET])
+
+   total = f"/{len(associations)//500 + 1}" if isinstance(associations, list) else ""
+   def run_batch(numbered_batch):
+      number, batch = numbered_batch
+      log(f"batch {number}{total}")
+      associate_batch(batch)
 
-   for i in range(0, len(associations), 500):
-      log(f"batch {i//500 + 1}/{len(associations)//500 + 1}")
-      batch = associations[i:i+500]
-      associate_batch(batch, 0)
-      time.sleep(0.25)
+   for _ in run_batches(run_batch, enumerate(chunked(associations, 500), 1), workers):
+      pass
 
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from pathlib import Path
+from functions.hubspot_client import portal_key
+from functions.cache_db import connect_cache
+
+CACHE_PATH = Path(__file__).parent.parent.parent / "cache" / "association_cache.sqlite3"
+DEFAULT_TTL_HOURS = 24
+
+# from ID -> to ID -> association type IDs
+Existing = dict[str, dict[str, set[int]]]
+
+class AssociationCache:
+    # Persists the associations read from HubSpot so re-runs only read records they haven't seen recently.
+    # A record with no associations is remembered too, through the reads table.
+    def __init__(self, path: Path = CACHE_PATH, ttl_hours: float | None = None, portal: str | None = None):
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv("ASSOCIATION_CACHE_TTL_HOURS") or DEFAULT_TTL_HOURS)
+        self.ttl = ttl_hours * 3600
+        self.portal = portal or portal_key()
+        self.lock = threading.Lock()
+        self.connection = connect_cache(path, ["association_reads", "associations"])
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS association_reads (
+                portal TEXT NOT NULL,
+                from_type TEXT NOT NULL,
+                to_type TEXT NOT NULL,
+                from_id TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (portal, from_type, to_type, from_id)
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS associations (
+                portal TEXT NOT NULL,
+                from_type TEXT NOT NULL,
+                to_type TEXT NOT NULL,
+                from_id TEXT NOT NULL,
+                to_id TEXT NOT NULL,
+                type_id INTEGER NOT NULL,
+                PRIMARY KEY (portal, from_type, to_type, from_id, to_id, type_id)
+            )
+        """)
+        self.connection.commit()
+
+    def get_many(self, from_type: str, to_type: str, from_ids: list[str]) -> Existing:
+        # Only records read within the TTL are returned, with an empty dict if they had no associations
+        found: Existing = {}
+        oldest = time.time() - self.ttl
+        with self.lock:
+            for i in range(0, len(from_ids), 500):
+                batch = from_ids[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT from_id FROM association_reads WHERE portal = ? AND from_type = ? AND to_type = ? AND fetched_at >= ? AND from_id IN ({placeholders})",
+                    [self.portal, from_type, to_type, oldest, *batch],
+                )
+                read = [from_id for (from_id,) in rows]
+                for from_id in read:
+                    found[from_id] = {}
+                if not read:
+                    continue
+                placeholders = ",".join("?" * len(read))
+                rows = self.connection.execute(
+                    f"SELECT from_id, to_id, type_id FROM associations WHERE portal = ? AND from_type = ? AND to_type = ? AND from_id IN ({placeholders})",
+                    [self.portal, from_type, to_type, *read],
+                )
+                for from_id, to_id, type_id in rows:
+                    found[from_id].setdefault(to_id, set()).add(type_id)
+        return found
+
+    def put_many(self, from_type: str, to_type: str, existing: Existing):
+        # Replaces everything cached for these records with what was just read
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM associations WHERE portal = ? AND from_type = ? AND to_type = ? AND from_id = ?",
+                [(self.portal, from_type, to_type, from_id) for from_id in existing],
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO associations (portal, from_type, to_type, from_id, to_id, type_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.portal, from_type, to_type, from_id, to_id, type_id) for from_id, to_ids in existing.items() for to_id, type_ids in to_ids.items() for type_id in type_ids],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO association_reads (portal, from_type, to_type, from_id, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                [(self.portal, from_type, to_type, from_id, now) for from_id in existing],
+            )
+            self.connection.commit()
+
+    def add(self, from_type: str, to_type: str, associations: list[tuple[str, str, int]]):
+        # Associations this run created, so the cache stays accurate without reading them back
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO associations (portal, from_type, to_type, from_id, to_id, type_id) VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.portal, from_type, to_type, from_id, to_id, type_id) for from_id, to_id, type_id in associations],
+            )
+            self.connection.commit()
+
+    def remove(self, from_type: str, to_type: str, associations: list[tuple[str, str, int]]):
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM associations WHERE portal = ? AND from_type = ? AND to_type = ? AND from_id = ? AND to_id = ? AND type_id = ?",
+                [(self.portal, from_type, to_type, from_id, to_id, type_id) for from_id, to_id, type_id in associations],
+            )
+            self.connection.commit()
+
+    def invalidate(self, from_type: str | None = None) -> int:
+        with self.lock:
+            if from_type:
+                self.connection.execute("DELETE FROM association_reads WHERE portal = ? AND from_type = ?", [self.portal, from_type])
+                cursor = self.connection.execute("DELETE FROM associations WHERE portal = ? AND from_type = ?", [self.portal, from_type])
+            else:
+                self.connection.execute("DELETE FROM association_reads WHERE portal = ?", [self.portal])
+                cursor = self.connection.execute("DELETE FROM associations WHERE portal = ?", [self.portal])
+            self.connection.commit()
+            return cursor.rowcount
+
+_association_cache: AssociationCache | None = None
+
+_association_cache_lock = threading.Lock()
+
+def get_association_cache() -> AssociationCache:
+    # Created on first use so ASSOCIATION_CACHE_TTL_HOURS is read after load_dotenv(), locked like get_id_cache()
+    global _association_cache
+    with _association_cache_lock:
+        if _association_cache is None:
+            _association_cache = AssociationCache()
+    return _association_cache
@@ -1,7 +1,15 @@
-from typing import TypedDict, Literal, NotRequired
+from typing import TypedDict, Literal, NotRequired, Callable, Iterable
 import requests
 import time
 from functions.logger import log
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
+from functions.run_batches import run_batches
+from functions.parse_csv import chunked
+from functions.metrics import metrics
+from functions.dead_letter import RECORD_ERROR_STATUSES, SPLIT_FAILURE_BUDGET, dead_letters
+from functions.property_schema import load_schema, refresh_schema, validate_properties
+from functions.serializer import project_records, response_json
 
 class AssociationType(TypedDict):
     associationCategory: Literal["HUBSPOT_DEFINED", "USER_DEFINED"]
@@ -17,38 +25,127 @@ class CreateInput(TypedDict):
 
 def batch_create_records(
     record_type: str,
-    inputs: list[CreateInput],
+    inputs: Iterable[CreateInput],
     PRIVATE_APP_KEY: str,
+    workers: int = 1,
+    on_batch_created: Callable[[list[CreateInput], list[dict]], None] | None = None,
+    id_property: str | None = None,
+    on_batch_failed: Callable[[list[CreateInput], str, int | None], None] | None = None,
+    validate: bool = True,
 ) -> list[dict]:
-    url = f"https://api.hubapi.com/crm/v3/objects/{record_type}/batch/create"
-    headers = { "Authorization": f"Bearer {PRIVATE_APP_KEY}", "Content-Type": "application/json" }
+    # With id_property set, records are upserted on that unique property so re-runs don't duplicate them.
+    # Batch upsert doesn't take associations, so callers have to associate the returned records themselves.
+    url = f"{BASE_URL}/crm/v3/objects/{record_type}/batch/{'upsert' if id_property else 'create'}"
+    action = "upserting" if id_property else "creating"
     records: list[dict] = []
 
-    def create_batch(batch: list[CreateInput], retry: int):
-        data = { "inputs": batch }
-        try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            json_response = response.json()
-            records.extend(json_response["results"])
-            log(f"Created {record_type}: {len(json_response['results'])}")
-        except requests.exceptions.RequestException as e:
-            if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
-                retry = retry + 1
-                interval = retry * 2
-                log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
-                time.sleep(interval)
-                create_batch(batch, retry)
-            elif retry == 5:
-                log("Max retries reached. Skipping batch.")
-            else:
+    # Rows the portal's schema would reject are caught here instead of failing a whole batch round-trip
+    schema = load_schema(record_type, PRIVATE_APP_KEY) if validate else None
+    if validate and schema is None:
+        log(f"No {record_type} schema available, sending batches without validation", "warning")
+
+    def reject_invalid(batch: list[CreateInput]) -> list[CreateInput]:
+        nonlocal schema
+        valid: list[CreateInput] = []
+        for input in batch:
+            if any(name not in schema for name in input["properties"]):
+                schema = refresh_schema(record_type, PRIVATE_APP_KEY) or schema
+            errors = validate_properties(input["properties"], schema)
+            if not errors:
+                valid.append(input)
+                continue
+            error_msg = "; ".join(errors)
+            log(f"Invalid {record_type}: {error_msg}", "warning")
+            # Recorded like the 400 HubSpot would have returned for it
+            dead_letters.add(record_type, [input], error_msg, 400)
+            if on_batch_failed:
+                on_batch_failed([input], error_msg, 400)
+        return valid
+
+    def send_batch(batch: list[CreateInput]) -> tuple[list[dict], int | None, str | None]:
+        # Returns the created records, or the status and error of a request that failed after retries
+        if id_property:
+            data = { "inputs": [
+                { "idProperty": id_property, "id": input["properties"][id_property], "properties": input["properties"] }
+                for input in batch
+            ] }
+        else:
+            data = { "inputs": batch }
+        retry = 0
+        while True:
+            try:
+                response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=data)
+                response.raise_for_status()
+                json_response = response_json(response)
+                # Only the ID, and the upsert key, are read from the results, the echoed properties would just hold memory
+                json_response["results"] = project_records(json_response["results"], [id_property] if id_property else [])
+                if id_property:
+                    new_count = sum(1 for record in json_response["results"] if record.get("new"))
+                    log(f"Upserted {record_type}: {new_count} created, {len(json_response['results']) - new_count} updated")
+                else:
+                    log(f"Created {record_type}: {len(json_response['results'])}")
+                # Multi-status responses list the inputs that failed alongside the ones that succeeded
+                failed_inputs: list[CreateInput] = []
+                for error in json_response.get("errors", []):
+                    log(f"Error {action} {record_type}: {error.get('message')}", "error", context=error.get("context"))
+                    failed_ids = set((error.get("context") or {}).get("ids") or [])
+                    failed = [input for input in batch if id_property and input["properties"].get(id_property) in failed_ids]
+                    dead_letters.add(record_type, failed or [error.get("context")], error.get("message") or "", response.status_code)
+                    if failed and on_batch_failed:
+                        # Errors in a multi-status response are rejections of those inputs, like a 400 for a single record
+                        on_batch_failed(failed, error.get("message") or "", 400)
+                    failed_inputs.extend(failed)
+                metrics.record_records(response, len(json_response["results"]))
+                if on_batch_created:
+                    on_batch_created([input for input in batch if input not in failed_inputs] if failed_inputs else batch, json_response["results"])
+                return json_response["results"], None, None
+            except requests.exceptions.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and (status == 429 or str(status)[0] == "5") and retry < 5:
+                    retry += 1
+                    interval = backoff(e.response, retry)
+                    log(f"{'Rate limit exceeded' if status == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+                    time.sleep(interval)
+                    continue
+                if retry == 5:
+                    log(f"Max retries reached. Dead-lettering {len(batch)} {record_type}.", "error")
                 error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-                log(f"Error creating {record_type}: {error_msg}")
+                return [], status, error_msg
+
+    def fail_batch(batch: list[CreateInput], status: int | None, error_msg: str, budget: list[int]) -> list[dict]:
+        if status in RECORD_ERROR_STATUSES and len(batch) > 1 and budget[0] > 0:
+            # One bad record fails the whole batch, so keep halving it until the bad records are on their own
+            log(f"Error {action} {record_type}, splitting batch of {len(batch)}: {error_msg}", "warning")
+            middle = len(batch) // 2
+            halves = [batch[:middle], batch[middle:]]
+            attempts = [send_batch(half) for half in halves]
+            budget[0] -= sum(1 for attempt in attempts if attempt[2] is not None)
+            results = []
+            for half, (half_results, half_status, half_error) in zip(halves, attempts):
+                results += half_results if half_error is None else fail_batch(half, half_status, half_error, budget)
+            return results
+        if status in RECORD_ERROR_STATUSES and len(batch) > 1:
+            log(f"Split failure budget used up, dead-lettering {len(batch)} {record_type} without splitting further", "warning")
+        log(f"Error {action} {record_type}: {error_msg}", "error")
+        dead_letters.add(record_type, batch, error_msg, status)
+        if on_batch_failed:
+            on_batch_failed(batch, error_msg, status)
+        return []
+
+    def create_batch(batch: list[CreateInput]) -> list[dict]:
+        results, status, error_msg = send_batch(batch)
+        return results if error_msg is None else fail_batch(batch, status, error_msg, [SPLIT_FAILURE_BUDGET])
+
+    total = f"/{len(inputs)//100 + 1}" if isinstance(inputs, list) else ""
+    def run_batch(numbered_batch: tuple[int, list[CreateInput]]) -> list[dict]:
+        number, batch = numbered_batch
+        log(f"batch {number}{total}")
+        if schema:
+            batch = reject_invalid(batch)
+        return create_batch(batch) if batch else []
 
-    for i in range(0, len(inputs), 100):
-        log(f"batch {i//100 + 1}/{len(inputs)//100 + 1}")
-        create_batch(inputs[i:i+100], 0)
-        time.sleep(0.25)
+    for results in run_batches(run_batch, enumerate(chunked(inputs, 100), 1), workers):
+        records.extend(results)
     
-    log(f"Total {record_type} created: {len(records)}")
+    log(f"Total {record_type} {'upserted' if id_property else 'created'}: {len(records)}")
     return records
\ No newline at end of file
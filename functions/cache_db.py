@@ -0,0 +1,14 @@
+import sqlite3
+from pathlib import Path
+
+def connect_cache(path: Path, tables: list[str]) -> sqlite3.Connection:
+    # Opens one of the SQLite files under cache/. Shards of a sharded run write to the same file, so a locked
+    # database is waited on rather than failing. Rows saved before the tables were keyed by portal can't be
+    # attributed to one, so those tables are dropped and recreated by the caller.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    for table in tables:
+        columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+        if columns and "portal" not in columns:
+            connection.execute(f"DROP TABLE {table}")
+    return connection
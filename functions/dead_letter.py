@@ -0,0 +1,55 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+import json
+import os
+import sys
+import threading
+from functions.logger import log
+
+DEAD_LETTER_DIR = Path(__file__).parent.parent.parent / "dead_letters"
+# Statuses HubSpot returns for bad input rather than for the request as a whole, so splitting the batch can isolate the bad records
+RECORD_ERROR_STATUSES = (400, 409, 422)
+# Failed requests one batch may spend isolating bad records, enough for a few bad records in a batch of 100.
+# Past it the failing parts are dead-lettered whole, so an error that hits every record doesn't cost 2N-1 requests.
+SPLIT_FAILURE_BUDGET = 16
+
+class DeadLetters:
+    # Records HubSpot rejected, written with the error so they can be fixed and replayed on their own
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file = None
+        self.path: Path | None = None
+        self.counts: dict[str, int] = {}
+
+    def add(self, kind: str, records: list[Any], error: str, status: int | None = None):
+        with self.lock:
+            if self.file is None:
+                DEAD_LETTER_DIR.mkdir(parents=True, exist_ok=True)
+                script_name = Path(sys.argv[0]).stem or "run"
+                self.path = DEAD_LETTER_DIR / f"{script_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl"
+                self.file = open(self.path, "a", encoding="utf-8")
+            time = datetime.now().isoformat()
+            for record in records:
+                self.file.write(json.dumps({ "time": time, "kind": kind, "status": status, "error": error, "record": record }, default=str) + "\n")
+            self.file.flush()
+            self.counts[kind] = self.counts.get(kind, 0) + len(records)
+
+    def total(self) -> int:
+        with self.lock:
+            return sum(self.counts.values())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+dead_letters = DeadLetters()
+
+def output_dead_letters():
+    dead_letters.close()
+    if dead_letters.path is None:
+        log("Dead letters: none")
+        return
+    log(f"Dead letters: {dead_letters.counts} saved to {dead_letters.path.name}", "warning")
@@ -0,0 +1,217 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from functions.logger import log
+from functions.hubspot_client import portal_key
+from functions.cache_db import connect_cache
+
+STATE_PATH = Path(__file__).parent.parent.parent / "cache" / "delta_state.sqlite3"
+
+def parse_modified(value: str | None) -> datetime | None:
+    # Salesforce exports use 2024-01-01T00:00:00.000+0000
+    if not value:
+        return None
+    try:
+        modified = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return modified if modified.tzinfo else modified.replace(tzinfo=timezone.utc)
+
+def row_hash(row: dict, fields: Iterable[str]) -> str:
+    # Sorted so a re-ordered export hashes the same
+    content = "\x1f".join(f"{name}\x1e{row.get(name) or ''}" for name in sorted(fields))
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+class DeltaState:
+    # Per-entity watermark, row hashes from previous syncs and keys of rows that weren't synced, shared by every script.
+    # Kept per portal, since a row synced to a sandbox still has to be sent to production.
+    def __init__(self, path: Path = STATE_PATH, portal: str | None = None):
+        self.portal = portal or portal_key()
+        self.lock = threading.Lock()
+        self.connection = connect_cache(path, ["watermarks", "row_hashes", "unsynced"])
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                portal TEXT NOT NULL,
+                entity TEXT NOT NULL,
+                modified TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (portal, entity)
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS row_hashes (
+                portal TEXT NOT NULL,
+                entity TEXT NOT NULL,
+                key TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (portal, entity, key)
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS unsynced (
+                portal TEXT NOT NULL,
+                entity TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (portal, entity, key)
+            )
+        """)
+        self.connection.commit()
+
+    def watermark(self, entity: str) -> datetime | None:
+        with self.lock:
+            row = self.connection.execute("SELECT modified FROM watermarks WHERE portal = ? AND entity = ?", [self.portal, entity]).fetchone()
+        return parse_modified(row[0]) if row else None
+
+    def set_watermark(self, entity: str, modified: datetime):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO watermarks (portal, entity, modified, synced_at) VALUES (?, ?, ?, ?)",
+                [self.portal, entity, modified.isoformat(), time.time()],
+            )
+            self.connection.commit()
+
+    def get_hashes(self, entity: str, keys: list[str]) -> dict[str, str]:
+        found: dict[str, str] = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key, hash FROM row_hashes WHERE portal = ? AND entity = ? AND key IN ({placeholders})",
+                    [self.portal, entity, *batch],
+                )
+                found.update(rows)
+        return found
+
+    def put_hashes(self, entity: str, pairs: list[tuple[str, str]]):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO row_hashes (portal, entity, key, hash, synced_at) VALUES (?, ?, ?, ?, ?)",
+                [(self.portal, entity, key, digest, now) for key, digest in pairs],
+            )
+            self.connection.commit()
+
+    def get_unsynced(self, entity: str, keys: list[str]) -> set[str]:
+        found: set[str] = set()
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key FROM unsynced WHERE portal = ? AND entity = ? AND key IN ({placeholders})",
+                    [self.portal, entity, *batch],
+                )
+                found.update(key for (key,) in rows)
+        return found
+
+    def add_unsynced(self, entity: str, keys: list[str]):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO unsynced (portal, entity, key) VALUES (?, ?, ?)",
+                [(self.portal, entity, key) for key in keys],
+            )
+            self.connection.commit()
+
+    def remove_unsynced(self, entity: str, keys: list[str]):
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM unsynced WHERE portal = ? AND entity = ? AND key = ?",
+                [(self.portal, entity, key) for key in keys],
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class DeltaSync:
+    # Passes on only rows that are new or changed since the last sync of an entity. Rows modified before the
+    # watermark are skipped without hashing unless a previous run left them unsynced, the rest are compared against
+    # the hash stored when they were last synced.
+    # fields limits the hash to the columns the script sends, every column but modified_field by default.
+    # watermark_entity defaults to entity; shards keep their own watermark but share the row hashes and unsynced keys,
+    # so a row that moves to another shard between runs is still retried.
+    def __init__(self, state: DeltaState, entity: str, key_field: str, modified_field: str, fields: list[str] | None = None, watermark_entity: str | None = None):
+        self.state = state
+        self.entity = entity
+        self.key_field = key_field
+        self.modified_field = modified_field
+        self.fields = fields
+        self.watermark_entity = watermark_entity or entity
+        self.watermark = state.watermark(self.watermark_entity)
+        self.lock = threading.Lock()
+        # key -> hash for rows passed on but not yet synced
+        self.pending: dict[str, str] = {}
+        self.latest: datetime | None = None
+        self.counts = { "before_watermark": 0, "unchanged": 0, "new": 0, "changed": 0, "synced": 0 }
+        if self.watermark:
+            log(f"Delta sync of {entity} from {self.watermark.isoformat()}")
+        else:
+            log(f"No previous sync of {entity}, every row is compared against stored hashes")
+
+    def filter(self, rows: Iterable[dict], on_unchanged: Callable[[list[str]], None] | None = None, batch_size: int = 500) -> Iterator[dict]:
+        # Hashes are looked up in batches rather than one query per row
+        rows = iter(rows)
+        while batch := list(islice(rows, batch_size)):
+            candidates = []
+            before_watermark = []
+            for row in batch:
+                modified = parse_modified(row.get(self.modified_field))
+                if modified and (self.latest is None or modified > self.latest):
+                    self.latest = modified
+                if modified and self.watermark and modified < self.watermark:
+                    before_watermark.append(row)
+                else:
+                    candidates.append(row)
+
+            unsynced = self.state.get_unsynced(self.entity, [row[self.key_field] for row in before_watermark]) if before_watermark else set()
+            unchanged = []
+            for row in before_watermark:
+                if row[self.key_field] in unsynced:
+                    candidates.append(row)
+                else:
+                    self.counts["before_watermark"] += 1
+                    unchanged.append(row[self.key_field])
+
+            stored = self.state.get_hashes(self.entity, [row[self.key_field] for row in candidates])
+            for row in candidates:
+                key = row[self.key_field]
+                digest = row_hash(row, self.fields or [name for name in row if name is not None and name != self.modified_field])
+                if stored.get(key) == digest:
+                    self.counts["unchanged"] += 1
+                    unchanged.append(key)
+                    continue
+                self.counts["changed" if key in stored else "new"] += 1
+                with self.lock:
+                    self.pending[key] = digest
+                yield row
+            if unsynced:
+                # Rows left unsynced that are back to what was last synced need nothing sent
+                self.state.remove_unsynced(self.entity, [key for key in unchanged if key in unsynced])
+            if unchanged and on_unchanged:
+                on_unchanged(unchanged)
+
+    def synced(self, keys: Iterable[str]):
+        # Called once a row has been written to HubSpot so the next run can skip it
+        with self.lock:
+            pairs = [(key, self.pending.pop(key)) for key in keys if key in self.pending]
+        if pairs:
+            self.state.put_hashes(self.entity, pairs)
+            self.state.remove_unsynced(self.entity, [key for key, _ in pairs])
+            with self.lock:
+                self.counts["synced"] += len(pairs)
+
+    def commit(self):
+        # Failed and skipped rows are stored as unsynced and retried next time, so they don't hold the watermark back
+        if self.pending:
+            self.state.add_unsynced(self.entity, list(self.pending))
+        if self.latest and (self.watermark is None or self.latest > self.watermark):
+            self.state.set_watermark(self.watermark_entity, self.latest)
+            self.watermark = self.latest
+        log(f"Delta sync of {self.entity}: {self.counts}, {len(self.pending)} rows left for the next run, watermark {self.watermark.isoformat() if self.watermark else 'not set'}")
@@ -0,0 +1,106 @@
+import requests
+import time
+from typing import Iterable
+from functions.logger import log
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
+from functions.run_batches import run_batches
+from functions.parse_csv import chunked
+from functions.metrics import metrics
+from functions.dead_letter import dead_letters
+from functions.association_cache import Existing, get_association_cache
+from functions.serializer import response_json
+
+def read_association_batch(from_type: str, to_type: str, from_ids: list[str], PRIVATE_APP_KEY: str) -> Existing | None:
+    url = f"{BASE_URL}/crm/v4/associations/{from_type}/{to_type}/batch/read"
+    existing: Existing = { from_id: {} for from_id in from_ids }
+    inputs = [{ "id": from_id } for from_id in from_ids]
+    retry = 0
+    while inputs:
+        try:
+            response = hubspot_request("POST", url, PRIVATE_APP_KEY, json={ "inputs": inputs })
+            response.raise_for_status()
+            # Records without associations come back as errors in a 207 response, which just means none exist
+            json_response = response_json(response)
+            inputs = []
+            for result in json_response["results"]:
+                from_id = str(result["from"]["id"])
+                for to in result.get("to", []):
+                    existing.setdefault(from_id, {}).setdefault(str(to["toObjectId"]), set()).update(type["typeId"] for type in to.get("associationTypes", []))
+                # Records with more associations than fit in one page are read again from where they stopped
+                after = (result.get("paging") or {}).get("next", {}).get("after")
+                if after:
+                    inputs.append({ "id": from_id, "after": after })
+            metrics.record_records(response, len(json_response["results"]))
+            retry = 0
+        except requests.exceptions.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and (status == 429 or str(status)[0] == "5") and retry < 5:
+                retry += 1
+                interval = backoff(e.response, retry)
+                log(f"{'Rate limit exceeded' if status == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+                time.sleep(interval)
+                continue
+            error_msg = e.response.text if e.response is not None and e.response.text else str(e)
+            log(f"Error reading {from_type} to {to_type} associations: {error_msg}", "error")
+            return None
+    log(f"Read {from_type} to {to_type} associations: {len(from_ids)}")
+    return existing
+
+def read_associations(from_type: str, to_type: str, from_ids: Iterable[str], PRIVATE_APP_KEY: str, workers: int = 1) -> Existing:
+    # Records whose associations couldn't be read are left out, so callers can tell "none" from "unknown"
+    from_ids = list(set(from_id for from_id in from_ids if from_id))
+    if not from_ids:
+        return {}
+    association_cache = get_association_cache()
+    existing = association_cache.get_many(from_type, to_type, from_ids)
+    missing = [from_id for from_id in from_ids if from_id not in existing]
+    log(f"Reading {from_type} to {to_type} associations: {len(existing)} cached, {len(missing)} to read")
+
+    for read in run_batches(lambda batch: read_association_batch(from_type, to_type, batch, PRIVATE_APP_KEY), chunked(missing, 1000), workers):
+        if read is not None:
+            association_cache.put_many(from_type, to_type, read)
+            existing.update(read)
+    return existing
+
+def archive_associations(from_type, from_id_property, to_type, to_id_property, association_category, association_type_id, associations, PRIVATE_APP_KEY, workers=1, on_batch_archived=None, on_batch_failed=None):
+    # Removes only this association type from each pair, so labels and other associations between them are kept
+    url = f"{BASE_URL}/crm/v4/associations/{from_type}/{to_type}/batch/labels/archive"
+    kind = f"{from_type}_to_{to_type}_archive"
+    def archive_batch(batch: list[dict]):
+        data = { "inputs": [
+            {
+                "types": [{ "associationCategory": association_category, "associationTypeId": association_type_id }],
+                "from": { "id": assoc[from_id_property] },
+                "to": { "id": assoc[to_id_property] }
+            }
+            for assoc in batch
+        ] }
+        retry = 0
+        while True:
+            try:
+                response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=data)
+                response.raise_for_status()
+                log(f"Archived {from_type} to {to_type} associations: {len(batch)}")
+                metrics.record_records(response, len(batch))
+                get_association_cache().remove(from_type, to_type, [(assoc[from_id_property], assoc[to_id_property], association_type_id) for assoc in batch])
+                if on_batch_archived:
+                    on_batch_archived(batch)
+                return
+            except requests.exceptions.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and (status == 429 or str(status)[0] == "5") and retry < 5:
+                    retry += 1
+                    interval = backoff(e.response, retry)
+                    log(f"{'Rate limit exceeded' if status == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+                    time.sleep(interval)
+                    continue
+                error_msg = e.response.text if e.response is not None and e.response.text else str(e)
+                log(f"Error archiving {from_type} to {to_type} associations: {error_msg}", "error")
+                dead_letters.add(kind, batch, error_msg, status)
+                if on_batch_failed:
+                    on_batch_failed(batch, error_msg, status)
+                return
+
+    for _ in run_batches(archive_batch, chunked(associations, 500), workers):
+        pass
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+from functions.logger import log
+from functions.upload_file import LocalFile
+from functions.hubspot_client import portal_key
+from functions.cache_db import connect_cache
+
+HASH_DB_PATH = Path(__file__).parent.parent.parent / "cache" / "file_hashes.sqlite3"
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class FileDedup:
+    # Maps file content hashes to uploaded HubSpot file IDs so each unique file is uploaded once
+    def __init__(self, path: Path = HASH_DB_PATH, portal: str | None = None):
+        self.lock = threading.Lock()
+        self.in_flight: dict[str, threading.Event] = {}
+        self.reused_files = 0
+        self.reused_bytes = 0
+        self.portal = portal or portal_key()
+        self.connection = connect_cache(path, ["file_hashes"])
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                portal TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                uploaded_at REAL NOT NULL,
+                PRIMARY KEY (portal, hash)
+            )
+        """)
+        self.connection.commit()
+
+    def _lookup(self, digest: str) -> str | None:
+        row = self.connection.execute("SELECT file_id FROM file_hashes WHERE portal = ? AND hash = ?", [self.portal, digest]).fetchone()
+        return row[0] if row else None
+
+    def get_or_upload(self, file: LocalFile, upload: Callable[[], str | None]) -> str | None:
+        digest = hash_file(file["path"])
+        while True:
+            with self.lock:
+                file_id = self._lookup(digest)
+                if file_id:
+                    self.reused_files += 1
+                    self.reused_bytes += file["path"].stat().st_size
+                    log(f"Reusing uploaded file {file_id} for {file['name']}")
+                    return file_id
+                waiting_for = self.in_flight.get(digest)
+                if waiting_for is None:
+                    self.in_flight[digest] = threading.Event()
+                    break
+            # Another worker is uploading the same content, use its result once it finishes
+            waiting_for.wait()
+
+        try:
+            file_id = upload()
+            if file_id:
+                with self.lock:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO file_hashes (portal, hash, file_id, file_name, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                        [self.portal, digest, file_id, file["name"], time.time()],
+                    )
+                    self.connection.commit()
+            return file_id
+        finally:
+            with self.lock:
+                self.in_flight.pop(digest).set()
+
+    def summary(self) -> str:
+        return f"{self.reused_files} duplicate files reused, {self.reused_bytes / 1_000_000:.1f} MB not uploaded"
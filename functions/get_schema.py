@@ -1,25 +1,30 @@
 import requests
 import time
+from functions.logger import log
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
 
-def get_schema(object_type, HS_KEY, retry):
-    url = f"https://api.hubapi.com/crm/v3/schemas/{object_type}"
-    headers = { "Authorization": f"Bearer {HS_KEY}", "Content-Type": "application/json" }
+def get_schema(object_type, HS_KEY, retry=0, properties_api=False):
+    # The schemas API only covers custom objects, standard objects list their properties through the properties API
+    url = f"{BASE_URL}/crm/v3/properties/{object_type}" if properties_api else f"{BASE_URL}/crm/v3/schemas/{object_type}"
     try:
-        response = requests.get(url, headers=headers)
+        response = hubspot_request("GET", url, HS_KEY)
         response.raise_for_status()
         response_json = response.json()
-        print(f"Fetched HubSpot {object_type} schema")
-        time.sleep(0.25)
-        return response_json.get("properties", [])
+        log(f"Fetched HubSpot {object_type} schema")
+        return response_json.get("results" if properties_api else "properties", [])
     except requests.exceptions.RequestException as e:
         if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
             retry = retry + 1
-            interval = retry * 2
-            print(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
+            interval = backoff(e.response, retry)
+            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
             time.sleep(interval)
-            get_schema(object_type, HS_KEY, retry)
+            return get_schema(object_type, HS_KEY, retry, properties_api)
         elif retry == 5:
-            print("Max retries reached. Skipping schema fetch.")
+            log("Max retries reached. Skipping schema fetch.", "warning")
+        elif e.response is not None and e.response.status_code in (400, 403, 404) and not properties_api:
+            # 403 is a private app without the custom object schema scope, which can still read properties
+            return get_schema(object_type, HS_KEY, 0, True)
         else:
             error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-            print(f"Error fetching HubSpot {object_type} schema: {error_msg}")
\ No newline at end of file
+            log(f"Error fetching HubSpot {object_type} schema: {error_msg}", "error")
\ No newline at end of file
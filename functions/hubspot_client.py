@@ -0,0 +1,70 @@
+import hashlib
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from functions.rate_limiter import limiter_for
+from functions.metrics import metrics
+from functions.serializer import dumps
+
+# HUBSPOT_BASE_URL points the scripts at another server, e.g. benchmarks/mock_hubspot.py
+BASE_URL = os.getenv("HUBSPOT_BASE_URL") or "https://api.hubapi.com"
+POOL_SIZE = 32
+
+def portal_key(PRIVATE_APP_KEY: str | None = None) -> str:
+    # Identifies which portal cached HubSpot IDs came from, so a sandbox run's IDs are never reused against
+    # production. A hash so the key itself isn't written to disk.
+    key = PRIVATE_APP_KEY or os.getenv("PRIVATE_APP_KEY") or ""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+# Shared by every helper so connections are reused across calls
+_session: requests.Session | None = None
+
+_session_lock = threading.Lock()
+
+def get_session(PRIVATE_APP_KEY: str) -> requests.Session:
+    # Locked because the first requests can be sent from several threads at once, which would each create a session
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, pool_block=True)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session.headers.update({
+                "Authorization": f"Bearer {PRIVATE_APP_KEY}",
+                "Connection": "keep-alive",
+            })
+    return _session
+
+def hubspot_request(method: str, url: str, PRIVATE_APP_KEY: str, **kwargs) -> requests.Response:
+    if "json" in kwargs:
+        # Encoded here instead of by requests so the faster backend in functions/serializer.py is used
+        kwargs["data"] = dumps(kwargs.pop("json"))
+        kwargs["headers"] = { **(kwargs.get("headers") or {}), "Content-Type": "application/json" }
+    limiter = limiter_for(url)
+    limiter.acquire()
+    started = time.monotonic()
+    try:
+        response = get_session(PRIVATE_APP_KEY).request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        metrics.record_request(method, url, time.monotonic() - started, 0)
+        raise
+    metrics.record_request(method, url, time.monotonic() - started, response.status_code)
+    limiter.update(response)
+    return response
+
+def pool_stats() -> dict[str, int]:
+    stats = { "connections_opened": 0, "requests_sent": 0, "connections_reused": 0 }
+    if _session is None:
+        return stats
+    adapters = { id(adapter): adapter for adapter in _session.adapters.values() }
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats["connections_opened"] += pool.num_connections
+            stats["requests_sent"] += pool.num_requests
+    stats["connections_reused"] = max(stats["requests_sent"] - stats["connections_opened"], 0)
+    return stats
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from pathlib import Path
+from functions.hubspot_client import portal_key
+from functions.cache_db import connect_cache
+
+CACHE_PATH = Path(__file__).parent.parent.parent / "cache" / "id_cache.sqlite3"
+DEFAULT_TTL_HOURS = 24 * 7
+
+class IdCache:
+    # Persists external ID -> HubSpot ID lookups so re-runs can skip searching
+    def __init__(self, path: Path = CACHE_PATH, ttl_hours: float | None = None, portal: str | None = None):
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv("ID_CACHE_TTL_HOURS") or DEFAULT_TTL_HOURS)
+        self.ttl = ttl_hours * 3600
+        self.portal = portal or portal_key()
+        self.lock = threading.Lock()
+        self.connection = connect_cache(path, ["id_map"])
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS id_map (
+                portal TEXT NOT NULL,
+                object_type TEXT NOT NULL,
+                id_property TEXT NOT NULL,
+                ext_id TEXT NOT NULL,
+                hs_id TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (portal, object_type, id_property, ext_id, hs_id)
+            )
+        """)
+        self.connection.commit()
+
+    def get_many(self, object_type: str, id_property: str, ext_ids: list[str]) -> dict[str, list[str]]:
+        found: dict[str, list[str]] = {}
+        oldest = time.time() - self.ttl
+        with self.lock:
+            for i in range(0, len(ext_ids), 500):
+                batch = ext_ids[i:i+500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT ext_id, hs_id FROM id_map WHERE portal = ? AND object_type = ? AND id_property = ? AND fetched_at >= ? AND ext_id IN ({placeholders})",
+                    [self.portal, object_type, id_property, oldest, *batch],
+                )
+                for ext_id, hs_id in rows:
+                    found.setdefault(ext_id, []).append(hs_id)
+        return found
+
+    def put_many(self, object_type: str, id_property: str, pairs: list[tuple[str, str]]):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO id_map (portal, object_type, id_property, ext_id, hs_id, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.portal, object_type, id_property, ext_id, hs_id, now) for ext_id, hs_id in pairs],
+            )
+            self.connection.commit()
+
+    def invalidate(self, object_type: str | None = None) -> int:
+        with self.lock:
+            if object_type:
+                cursor = self.connection.execute("DELETE FROM id_map WHERE portal = ? AND object_type = ?", [self.portal, object_type])
+            else:
+                cursor = self.connection.execute("DELETE FROM id_map WHERE portal = ?", [self.portal])
+            self.connection.commit()
+            return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM id_map WHERE fetched_at < ?", [time.time() - self.ttl])
+            self.connection.commit()
+            return cursor.rowcount
+
+_id_cache: IdCache | None = None
+_id_cache_lock = threading.Lock()
+
+def get_id_cache() -> IdCache:
+    # Created on first use so ID_CACHE_TTL_HOURS is read after load_dotenv(). Locked because object types
+    # are resolved on several threads at once, which would otherwise each open their own connection.
+    global _id_cache
+    with _id_cache_lock:
+        if _id_cache is None:
+            _id_cache = IdCache()
+    return _id_cache
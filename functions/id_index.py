@@ -0,0 +1,30 @@
+import threading
+from functions.search_records import Record
+
+class IdIndex:
+    # External ID -> HubSpot IDs per object type, so joins are dict lookups instead of scans
+    def __init__(self):
+        self.ids: dict[str, dict[str, list[str]]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, object_type: str, ext_id: str, hs_id: str):
+        with self.lock:
+            hs_ids = self.ids.setdefault(object_type, {}).setdefault(ext_id, [])
+            if hs_id not in hs_ids:
+                hs_ids.append(hs_id)
+
+    def add_records(self, object_type: str, records: list[Record], ext_id_property: str):
+        for record in records:
+            ext_id = record["properties"].get(ext_id_property)
+            if ext_id:
+                self.add(object_type, ext_id, record["id"])
+
+    def get(self, object_type: str, ext_id: str) -> str | None:
+        hs_ids = self.ids.get(object_type, {}).get(ext_id)
+        return hs_ids[0] if hs_ids else None
+
+    def get_all(self, object_type: str, ext_id: str) -> list[str]:
+        return list(self.ids.get(object_type, {}).get(ext_id, []))
+
+    def count(self, object_type: str) -> int:
+        return len(self.ids.get(object_type, {}))
@@ -0,0 +1,57 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+JOURNAL_DIR = Path(__file__).parent.parent.parent / "journals"
+
+class Journal:
+    # Append-only record of finished work so an interrupted run can pick up where it stopped
+    def __init__(self, name: str, resume: bool = False):
+        JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
+        self.path = JOURNAL_DIR / f"{name}.jsonl"
+        self.lock = threading.Lock()
+        self.entries: dict[str, dict[str, Any]] = {}
+        newline = True
+        if resume and self.path.exists():
+            # Last line may be half written if the previous run crashed, so the file is cut back to the last
+            # complete entry before appending, otherwise new entries would be joined onto the broken line
+            complete = 0
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        break
+                    self.entries.setdefault(entry["kind"], {})[entry["key"]] = entry.get("value")
+                    complete += len(line)
+                    newline = line.endswith(b"\n")
+            os.truncate(self.path, complete)
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        if resume and not newline:
+            self.file.write("\n")
+
+    def done(self, kind: str, key: str) -> bool:
+        return key in self.entries.get(kind, {})
+
+    def get(self, kind: str, key: str) -> Any:
+        return self.entries.get(kind, {}).get(key)
+
+    def count(self, kind: str) -> int:
+        return len(self.entries.get(kind, {}))
+
+    def record(self, kind: str, key: str, value: Any = None):
+        self.record_many(kind, [(key, value)])
+
+    def record_many(self, kind: str, items: list[tuple[str, Any]]):
+        with self.lock:
+            for key, value in items:
+                self.entries.setdefault(kind, {})[key] = value
+                self.file.write(json.dumps({ "kind": kind, "key": key, "value": value }) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
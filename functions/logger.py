@@ -1,17 +1,67 @@
 from datetime import datetime
 from pathlib import Path
+import atexit
+import json
+import os
+import sys
+import threading
+import time
 
-logs = ""
+LOG_DIR = Path(__file__).parent.parent.parent / "logs"
+LEVELS = { "debug": 10, "info": 20, "warning": 30, "error": 40 }
+FLUSH_EVERY_LINES = 100
+FLUSH_EVERY_SECONDS = 1.0
 
-def log(message):
-    global logs
-    print(message)
-    logs = f"{logs}\n{message}"
+# Lines are appended to a JSON lines file as they're logged, so a crash keeps everything up to the last flush
+log_lock = threading.Lock()
+log_file = None
+log_file_path: Path | None = None
+min_level = LEVELS["info"]
+unflushed_lines = 0
+last_flush = 0.0
+
+def _open_log_file():
+    global log_file, log_file_path, min_level, last_flush
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    script_name = Path(sys.argv[0]).stem or "run"
+    log_file_path = LOG_DIR / f"{script_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl"
+    log_file = open(log_file_path, "a", encoding="utf-8", buffering=1024 * 1024)
+    min_level = LEVELS.get((os.getenv("LOG_LEVEL") or "info").lower(), LEVELS["info"])
+    last_flush = time.monotonic()
+    atexit.register(flush_logs)
+
+def log(message, level="info", **fields):
+    global unflushed_lines, last_flush
+    with log_lock:
+        if log_file is None:
+            _open_log_file()
+        if LEVELS[level] < min_level:
+            return
+        print(message)
+        record = { "time": datetime.now().isoformat(), "level": level, "message": str(message), **fields }
+        log_file.write(json.dumps(record, default=str) + "\n")
+        unflushed_lines += 1
+        now = time.monotonic()
+        if unflushed_lines >= FLUSH_EVERY_LINES or now - last_flush >= FLUSH_EVERY_SECONDS or LEVELS[level] >= LEVELS["error"]:
+            log_file.flush()
+            unflushed_lines = 0
+            last_flush = now
+
+def flush_logs():
+    global unflushed_lines
+    with log_lock:
+        if log_file is not None and not log_file.closed:
+            log_file.flush()
+            unflushed_lines = 0
 
 def output_logs(file_name):
-    timestamp = datetime.now().isoformat()
-    log_file_name = f"{file_name}_{timestamp}.txt"
-    log_dir = Path(__file__).parent.parent.parent / "logs" / log_file_name
-    with open(log_dir, "w") as f:
-        f.write(logs)
+    global log_file
+    with log_lock:
+        if log_file is None:
+            return
+        log_file.close()
+        log_file = None
+        timestamp = datetime.now().isoformat()
+        log_file_name = f"{file_name}_{timestamp}.jsonl"
+        os.replace(log_file_path, LOG_DIR / log_file_name)
     print(f"Log saved to {log_file_name}")
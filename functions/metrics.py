@@ -0,0 +1,114 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+import requests
+from functions.logger import log
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+METRICS_DIR = Path(__file__).parent.parent.parent / "logs"
+
+def endpoint_name(method: str, url: str) -> str:
+    # Record IDs in the path are collapsed so calls group by endpoint
+    path = re.sub(r"/\d+(?=/|$)", "/{id}", urlsplit(url).path)
+    return f"{method.upper()} {path}"
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.records = 0
+        self.latency_total = 0.0
+        self.latency_counts = [0] * len(LATENCY_BUCKETS)
+
+    def percentile(self, fraction: float) -> float:
+        # Upper bound of the histogram bucket that holds the given fraction of requests
+        target = self.requests * fraction
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.endpoints: dict[str, EndpointMetrics] = {}
+
+    def _endpoint(self, name: str) -> EndpointMetrics:
+        if name not in self.endpoints:
+            self.endpoints[name] = EndpointMetrics()
+        return self.endpoints[name]
+
+    def record_request(self, method: str, url: str, seconds: float, status: int):
+        with self.lock:
+            endpoint = self._endpoint(endpoint_name(method, url))
+            endpoint.requests += 1
+            endpoint.latency_total += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    endpoint.latency_counts[i] += 1
+                    break
+            if status == 429:
+                endpoint.rate_limited += 1
+            elif status == 0 or status >= 400:
+                endpoint.errors += 1
+
+    def record_retry(self, response: requests.Response):
+        with self.lock:
+            self._endpoint(endpoint_name(response.request.method, response.url)).retries += 1
+
+    def record_records(self, response: requests.Response, count: int):
+        with self.lock:
+            self._endpoint(endpoint_name(response.request.method, response.url)).records += count
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        lines = [f"HubSpot API metrics over {elapsed:.1f}s:"]
+        with self.lock:
+            for name, endpoint in sorted(self.endpoints.items()):
+                average = endpoint.latency_total / endpoint.requests if endpoint.requests else 0
+                lines.append(
+                    f"  {name}: {endpoint.requests} requests, {endpoint.retries} retries, {endpoint.rate_limited} 429s, {endpoint.errors} errors, "
+                    f"avg {average:.3f}s p50 <={endpoint.percentile(0.5)}s p95 <={endpoint.percentile(0.95)}s, "
+                    f"{endpoint.records} records ({endpoint.records / elapsed:.1f}/s)"
+                )
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name, endpoint in sorted(self.endpoints.items()):
+                method, path = name.split(" ", 1)
+                labels = f'method="{method}",endpoint="{path}"'
+                lines.append(f"hubspot_requests_total{{{labels}}} {endpoint.requests}")
+                lines.append(f"hubspot_request_errors_total{{{labels}}} {endpoint.errors}")
+                lines.append(f"hubspot_rate_limited_total{{{labels}}} {endpoint.rate_limited}")
+                lines.append(f"hubspot_retries_total{{{labels}}} {endpoint.retries}")
+                lines.append(f"hubspot_records_total{{{labels}}} {endpoint.records}")
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, endpoint.latency_counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'hubspot_request_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"hubspot_request_seconds_sum{{{labels}}} {endpoint.latency_total:.6f}")
+                lines.append(f"hubspot_request_seconds_count{{{labels}}} {endpoint.requests}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def output_metrics(file_name: str):
+    log(metrics.summary())
+    if (os.getenv("METRICS_PROMETHEUS") or "").lower() in ("1", "true", "yes"):
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        metrics_file_name = f"{file_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prom"
+        with open(METRICS_DIR / metrics_file_name, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus())
+        log(f"Metrics saved to {metrics_file_name}")
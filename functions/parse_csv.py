@@ -1,17 +1,25 @@
 import csv
 import os
+from itertools import islice
 from pathlib import Path
+from typing import Iterable, Iterator, TypeVar
 from functions.logger import log
 
-def parse_csv(csv_file_path):
+T = TypeVar("T")
+
+def resolve_csv_path(csv_file_path):
     # Get absolute path if relative path is provided
     if not os.path.isabs(csv_file_path):
         project_root = Path(__file__).parent.parent.parent
         csv_file_path = project_root / csv_file_path
+    return csv_file_path
+
+def parse_csv(csv_file_path):
+    csv_file_path = resolve_csv_path(csv_file_path)
     
     # Check if file exists
     if not os.path.exists(csv_file_path):
-        log(f"Error: File not found at {csv_file_path}")
+        log(f"Error: File not found at {csv_file_path}", "error")
         return []
     
     # Parse CSV to list of dictionaries
@@ -25,5 +33,51 @@ def parse_csv(csv_file_path):
         log(f"Successfully parsed {len(data)} rows from {csv_file_path}")
         return data
     except Exception as e:
-        log(f"Error parsing CSV file: {str(e)}")
-        return []
\ No newline at end of file
+        log(f"Error parsing CSV file: {str(e)}", "error")
+        return []
+
+def stream_csv(csv_file_path) -> Iterator[dict[str, str]]:
+    # Yields rows one at a time so memory doesn't grow with the file size
+    csv_file_path = resolve_csv_path(csv_file_path)
+    if not os.path.exists(csv_file_path):
+        log(f"Error: File not found at {csv_file_path}", "error")
+        return
+    count = 0
+    try:
+        with open(csv_file_path, 'r', encoding='utf-8', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                count += 1
+                yield row
+        log(f"Successfully streamed {count} rows from {csv_file_path}")
+    except Exception as e:
+        log(f"Error parsing CSV file after {count} rows: {str(e)}", "error")
+        # A partly read file must not look like a complete one, e.g. to --delta moving its watermark
+        raise
+
+def read_blocks(file, block_size: int) -> Iterator[str]:
+    # Cuts the file into blocks of whole records without parsing it. A newline only ends a record outside
+    # quotes, which in a well formed CSV means an even number of quote characters before it.
+    carry = ""
+    while True:
+        data = file.read(block_size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        block = carry + data
+        end = block.rfind("\n")
+        while end != -1 and block.count('"', 0, end) % 2:
+            end = block.rfind("\n", 0, end)
+        if end == -1:
+            carry = block
+            continue
+        yield block[:end + 1]
+        carry = block[end + 1:]
+
+def chunked(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,69 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator
+from functions.logger import log
+
+_DONE = object()
+
+class Pipeline:
+    # Runs each stage on its own thread with bounded queues in between, so stage N works
+    # on the next chunk while stage N+1 is still busy with the previous one
+    def __init__(self, source: Iterable[Any], queue_size: int = 2):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages: list[tuple[str, Callable[[Any], Any]]] = []
+
+    def stage(self, name: str, fn: Callable[[Any], Any]) -> "Pipeline":
+        # Returning None from a stage drops the chunk
+        self.stages.append((name, fn))
+        return self
+
+    def run(self) -> Iterator[Any]:
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        errors: list[BaseException] = []
+        failed = threading.Event()
+
+        def feed():
+            try:
+                for item in self.source:
+                    if failed.is_set():
+                        break
+                    queues[0].put(item)
+            except BaseException as e:
+                log(f"Error in pipeline source: {e}", "error")
+                errors.append(e)
+                failed.set()
+            finally:
+                queues[0].put(_DONE)
+
+        def work(name: str, fn: Callable[[Any], Any], inbox: queue.Queue, outbox: queue.Queue):
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    outbox.put(_DONE)
+                    return
+                # After a failure, keep draining so upstream stages don't block forever
+                if failed.is_set():
+                    continue
+                try:
+                    result = fn(item)
+                except BaseException as e:
+                    log(f"Error in pipeline stage {name}: {e}", "error")
+                    errors.append(e)
+                    failed.set()
+                    continue
+                if result is not None:
+                    outbox.put(result)
+
+        threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+        for i, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(target=work, args=(name, fn, queues[i], queues[i + 1]), name=f"pipeline-{name}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        while (item := queues[-1].get()) is not _DONE:
+            yield item
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
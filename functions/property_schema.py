@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from functions.logger import log
+from functions.get_schema import get_schema
+from functions.hubspot_client import portal_key
+
+SCHEMA_DIR = Path(__file__).parent.parent.parent / "cache" / "schemas"
+DEFAULT_TTL_HOURS = 24
+
+def schema_path(object_type: str, PRIVATE_APP_KEY: str) -> Path:
+    # Per portal, since a sandbox and production can have different properties
+    return SCHEMA_DIR / f"{object_type}_{portal_key(PRIVATE_APP_KEY)}.json"
+
+# Fetched once per object type per run, and reused across runs until SCHEMA_CACHE_TTL_HOURS passes
+schemas: dict[str, dict[str, dict] | None] = {}
+schema_lock = threading.Lock()
+# Object types fetched again this run because a row used a property the cached schema didn't have
+refreshed: set[str] = set()
+
+def fetch_schema(object_type: str, PRIVATE_APP_KEY: str) -> list[dict] | None:
+    properties = get_schema(object_type, PRIVATE_APP_KEY)
+    if properties:
+        SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
+        path = schema_path(object_type, PRIVATE_APP_KEY)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({ "fetched_at": time.time(), "properties": properties }, f)
+        os.replace(temp_path, path)
+    return properties
+
+def load_schema(object_type: str, PRIVATE_APP_KEY: str) -> dict[str, dict] | None:
+    with schema_lock:
+        if object_type in schemas:
+            return schemas[object_type]
+        ttl = float(os.getenv("SCHEMA_CACHE_TTL_HOURS") or DEFAULT_TTL_HOURS) * 3600
+        path = schema_path(object_type, PRIVATE_APP_KEY)
+        properties = None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if time.time() - cached["fetched_at"] < ttl:
+                properties = cached["properties"]
+                log(f"Loaded {object_type} schema from cache")
+        except (OSError, ValueError, KeyError):
+            pass
+        if properties is None:
+            properties = fetch_schema(object_type, PRIVATE_APP_KEY)
+        schemas[object_type] = { property["name"]: property for property in properties } if properties else None
+        return schemas[object_type]
+
+def refresh_schema(object_type: str, PRIVATE_APP_KEY: str) -> dict[str, dict] | None:
+    # A property created after the schema was cached would otherwise reject every row until the TTL passes.
+    # Only fetched once per run, so rows with a property that really doesn't exist don't refetch it each time.
+    with schema_lock:
+        if object_type not in refreshed:
+            refreshed.add(object_type)
+            log(f"Fetching the {object_type} schema again for a property the cached one doesn't have")
+            properties = fetch_schema(object_type, PRIVATE_APP_KEY)
+            if properties:
+                schemas[object_type] = { property["name"]: property for property in properties }
+        return schemas.get(object_type)
+
+def invalidate_schemas(object_type: str | None = None) -> int:
+    removed = 0
+    for path in SCHEMA_DIR.glob(f"{object_type}_*.json" if object_type else "*.json"):
+        path.unlink()
+        removed += 1
+    return removed
+
+def is_timestamp(value: str) -> bool:
+    # Date and datetime properties take ISO 8601 or milliseconds since the epoch
+    if value.isdigit():
+        return True
+    try:
+        datetime.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+def validate_properties(properties: dict[str, str], schema: dict[str, dict]) -> list[str]:
+    errors = []
+    for name, value in properties.items():
+        property = schema.get(name)
+        if property is None:
+            errors.append(f"{name} is not a property")
+            continue
+        if (property.get("modificationMetadata") or {}).get("readOnlyValue"):
+            errors.append(f"{name} is read only")
+            continue
+        # Empty values clear the property and are always allowed
+        if value is None or value == "":
+            continue
+        value = str(value)
+        type = property.get("type")
+        if type == "number":
+            try:
+                float(value)
+            except ValueError:
+                errors.append(f"{name} {value!r} is not a number")
+        elif type == "bool":
+            if value.lower() not in ("true", "false"):
+                errors.append(f"{name} {value!r} is not true or false")
+        elif type in ("date", "datetime"):
+            if not is_timestamp(value):
+                errors.append(f"{name} {value!r} is not a valid {type}")
+        elif type == "enumeration" and property.get("options"):
+            options = { option["value"] for option in property["options"] }
+            values = value.split(";") if property.get("fieldType") == "checkbox" else [value]
+            invalid = [item for item in values if item not in options]
+            if invalid:
+                errors.append(f"{name} {', '.join(invalid)} not in options")
+    return errors
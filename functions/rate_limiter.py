@@ -0,0 +1,90 @@
+import threading
+import time
+import requests
+from functions.metrics import metrics
+
+# Private app defaults, replaced by the limits HubSpot reports in response headers
+DEFAULT_MAX_REQUESTS = 100
+DEFAULT_INTERVAL_SECONDS = 10
+# Search endpoints have their own per-second limit and send no rate limit headers
+SEARCH_MAX_REQUESTS = 5
+SEARCH_INTERVAL_SECONDS = 1
+
+class RateLimiter:
+    def __init__(self, max_requests: int, interval_seconds: float):
+        self.lock = threading.Lock()
+        self.capacity = float(max_requests)
+        self.rate = max_requests / interval_seconds
+        self.tokens = float(max_requests)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # Fraction of the portal's limit this process may use, when several processes share it
+        self.share = 1.0
+
+    def set_share(self, share: float):
+        with self.lock:
+            self.capacity *= share / self.share
+            self.rate *= share / self.share
+            self.tokens = min(self.tokens, self.capacity)
+            self.share = share
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def update(self, response: requests.Response):
+        headers = response.headers
+        max_requests = headers.get("X-HubSpot-RateLimit-Max")
+        interval_ms = headers.get("X-HubSpot-RateLimit-Interval-Milliseconds")
+        remaining = headers.get("X-HubSpot-RateLimit-Remaining")
+        secondly = headers.get("X-HubSpot-RateLimit-Secondly")
+        with self.lock:
+            if max_requests and interval_ms:
+                self.capacity = float(max_requests) * self.share
+                self.rate = int(max_requests) / (int(interval_ms) / 1000) * self.share
+            if secondly:
+                self.rate = min(self.rate, float(secondly) * self.share)
+            if remaining is not None:
+                self._refill(time.monotonic())
+                self.tokens = min(self.tokens, float(remaining))
+
+    def backoff(self, response: requests.Response | None, retry: int) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            interval = float(retry_after)
+        elif response is not None and response.status_code == 429:
+            interval = float(max(retry, 1))
+        else:
+            # Server errors aren't rate related, so only the failing call waits
+            return retry * 2
+        with self.lock:
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + interval)
+        return interval
+
+default_limiter = RateLimiter(DEFAULT_MAX_REQUESTS, DEFAULT_INTERVAL_SECONDS)
+search_limiter = RateLimiter(SEARCH_MAX_REQUESTS, SEARCH_INTERVAL_SECONDS)
+
+def limiter_for(url: str) -> RateLimiter:
+    return search_limiter if url.rstrip("/").endswith("/search") else default_limiter
+
+def set_rate_share(share: float):
+    default_limiter.set_share(share)
+    search_limiter.set_share(share)
+
+def backoff(response: requests.Response | None, retry: int) -> float:
+    if response is None:
+        return retry * 2
+    metrics.record_retry(response)
+    return limiter_for(response.url).backoff(response, retry)
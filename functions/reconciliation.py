@@ -0,0 +1,52 @@
+import threading
+from collections import Counter
+from typing import Callable, Iterable
+from functions.logger import log
+from functions.write_to_csv import write_to_csv
+from functions.dead_letter import RECORD_ERROR_STATUSES
+
+# Ordered from best to worst outcome; a key reported more than once keeps the worst
+BUCKETS = ("imported", "skipped_no_parent", "failed_in_api", "dead_lettered")
+
+def failure_bucket(status: int | None) -> str:
+    # Records HubSpot rejected need fixing before they're replayed from the dead-letter file,
+    # anything else (retries exhausted, connection errors) can simply be run again
+    return "dead_lettered" if status in RECORD_ERROR_STATUSES else "failed_in_api"
+
+class Reconciliation:
+    # Tracks the outcome of every source row by key so the report is built with dict lookups
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.outcomes: dict[str, tuple[str, str]] = {}
+
+    def add(self, bucket: str, keys: Iterable[str], reason: str = ""):
+        rank = BUCKETS.index(bucket)
+        with self.lock:
+            for key in keys:
+                current = self.outcomes.get(key)
+                if current is None or BUCKETS.index(current[0]) < rank:
+                    self.outcomes[key] = (bucket, reason)
+                elif current[0] == bucket and reason and reason not in current[1]:
+                    self.outcomes[key] = (bucket, f"{current[1]}; {reason}" if current[1] else reason)
+
+    def counts(self) -> dict[str, int]:
+        with self.lock:
+            counts = Counter(bucket for bucket, _ in self.outcomes.values())
+        return { bucket: counts.get(bucket, 0) for bucket in BUCKETS }
+
+    def output(self, rows: Callable[[], Iterable[dict]], key_field: str):
+        # rows is called once per non-empty bucket and should stream the source again rather than hold it in memory
+        counts = self.counts()
+        log(f"Reconciliation for {self.name}: {counts}")
+        for bucket in BUCKETS:
+            if not counts[bucket]:
+                continue
+            write_to_csv(
+                f"reconciliation/{self.name}_{bucket}",
+                (
+                    { **row, "reason": self.outcomes[row[key_field]][1] }
+                    for row in rows()
+                    if self.outcomes.get(row[key_field], ("", ""))[0] == bucket
+                )
+            )
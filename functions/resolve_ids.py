@@ -0,0 +1,103 @@
+from typing import Iterable
+import requests
+import time
+from functions.logger import log
+from functions.search_records import Record, SearchBody, iter_search_pages
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
+from functions.metrics import metrics
+from functions.id_index import IdIndex
+from functions.id_cache import get_id_cache
+from functions.serializer import project_records, response_json
+
+# Properties HubSpot rejected as a batch read idProperty (not unique), so they go straight to search
+search_only_properties: set[tuple[str, str]] = set()
+
+def batch_read_records(
+    object_type: str,
+    id_property: str,
+    ext_ids: list[str],
+    PRIVATE_APP_KEY: str,
+) -> list[Record] | None:
+    url = f"{BASE_URL}/crm/v3/objects/{object_type}/batch/read"
+    data = {
+        "idProperty": id_property,
+        "properties": [id_property],
+        "inputs": [{ "id": ext_id } for ext_id in ext_ids]
+    }
+    retry = 0
+    while True:
+        try:
+            response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=data)
+            response.raise_for_status()
+            # Unknown IDs come back as errors in a 207 response, which just means no match
+            json_response = response_json(response)
+            log(f"Read {object_type}: {len(json_response['results'])}")
+            metrics.record_records(response, len(json_response["results"]))
+            return project_records(json_response["results"], [id_property])
+        except requests.exceptions.RequestException as e:
+            if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
+                retry = retry + 1
+                interval = backoff(e.response, retry)
+                log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+                time.sleep(interval)
+            else:
+                if e.response is not None and e.response.status_code == 400:
+                    search_only_properties.add((object_type, id_property))
+                error_msg = e.response.text if e.response is not None and e.response.text else str(e)
+                log(f"Batch read of {object_type} by {id_property} failed, falling back to search: {error_msg}", "warning")
+                return None
+
+def resolve_ids(
+    object_type: str,
+    id_property: str,
+    ext_ids: Iterable[str],
+    PRIVATE_APP_KEY: str,
+    id_index: IdIndex,
+) -> IdIndex:
+    # Skip IDs an earlier call already resolved into the index
+    ext_ids = list(set(ext_id for ext_id in ext_ids if ext_id and id_index.get(object_type, ext_id) is None))
+    if not ext_ids:
+        return id_index
+    id_cache = get_id_cache()
+
+    # Check the local cache first
+    cached = id_cache.get_many(object_type, id_property, ext_ids)
+    for ext_id, hs_ids in cached.items():
+        for hs_id in hs_ids:
+            id_index.add(object_type, ext_id, hs_id)
+    missing = [ext_id for ext_id in ext_ids if ext_id not in cached]
+    log(f"Resolving {object_type}: {len(cached)} cached, {len(missing)} to look up")
+
+    def add_records(records: list[Record]):
+        id_index.add_records(object_type, records, id_property)
+        id_cache.put_many(object_type, id_property, [
+            (record["properties"][id_property], record["id"])
+            for record in records if record["properties"].get(id_property)
+        ])
+
+    # Batch read by ID property where possible, since search has a much tighter rate limit
+    for i in range(0, len(missing), 100):
+        log(f"batch {i//100 + 1}/{len(missing)//100 + 1}")
+        batch = missing[i:i+100]
+        records = None
+        if (object_type, id_property) not in search_only_properties:
+            records = batch_read_records(object_type, id_property, batch, PRIVATE_APP_KEY)
+        if records is not None:
+            add_records(records)
+            continue
+        search_body: SearchBody = {
+            "filterGroups": [{
+                "filters": [{
+                    "propertyName": id_property,
+                    "operator": "IN",
+                    "values": batch
+                }]
+            }],
+            "properties": [id_property],
+            "limit": 100
+        }
+        for records in iter_search_pages(object_type, search_body, PRIVATE_APP_KEY):
+            add_records(records)
+
+    return id_index
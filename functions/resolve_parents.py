@@ -0,0 +1,56 @@
+from typing import Iterable, TypedDict
+from functions.logger import log
+from functions.batch_create_records import Association
+from functions.id_index import IdIndex
+from functions.resolve_ids import resolve_ids
+from functions.run_batches import run_batches
+
+class ParentType(TypedDict):
+    object_type: str
+    id_property: str
+    association_type_id: int
+
+class ParentResolver:
+    # Resolves polymorphic parent IDs, like a Salesforce ParentId, whose prefix tells which object they point to
+    def __init__(self, parent_types: dict[str, ParentType], PRIVATE_APP_KEY: str, id_index: IdIndex, prefix_length: int = 3):
+        self.parent_types = parent_types
+        self.PRIVATE_APP_KEY = PRIVATE_APP_KEY
+        self.id_index = id_index
+        self.prefix_length = prefix_length
+        self.object_types = { parent["association_type_id"]: parent["object_type"] for parent in parent_types.values() }
+
+    def parent_type(self, ext_id: str | None) -> ParentType | None:
+        return self.parent_types.get(ext_id[:self.prefix_length]) if ext_id else None
+
+    def resolve(self, ext_ids: Iterable[str | None]):
+        # One pass to group by prefix, then every object type is resolved at the same time
+        groups: dict[str, list[str]] = {}
+        for ext_id in ext_ids:
+            if ext_id and ext_id[:self.prefix_length] in self.parent_types:
+                groups.setdefault(ext_id[:self.prefix_length], []).append(ext_id)
+
+        def resolve_group(group: tuple[str, list[str]]):
+            parent = self.parent_types[group[0]]
+            resolve_ids(parent["object_type"], parent["id_property"], group[1], self.PRIVATE_APP_KEY, self.id_index)
+
+        for _ in run_batches(resolve_group, groups.items(), len(groups)):
+            pass
+
+    def association(self, ext_id: str | None) -> Association | None:
+        parent = self.parent_type(ext_id)
+        hs_id = parent and self.id_index.get(parent["object_type"], ext_id)
+        if not hs_id:
+            return None
+        return {
+            "types": [{ "associationCategory": "HUBSPOT_DEFINED", "associationTypeId": parent["association_type_id"] }],
+            "to": { "id": hs_id }
+        }
+
+    def missing_reason(self, ext_id: str | None) -> str:
+        if not ext_id:
+            return "No parent ID"
+        parent = self.parent_type(ext_id)
+        if not parent:
+            log(f"No parent type configured for prefix {ext_id[:self.prefix_length]}", "debug")
+            return f"No parent type configured for {ext_id}"
+        return f"No HubSpot {parent['object_type']} found for {ext_id}"
@@ -0,0 +1,22 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+def run_batches(fn: Callable[[T], R], batches: Iterable[T], workers: int = 1) -> Iterator[R]:
+    # Results come back in the same order as batches, whatever order they finish in.
+    # Only a few batches are pulled ahead of the workers so lazy inputs stay lazy.
+    if workers <= 1:
+        for batch in batches:
+            yield fn(batch)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(fn, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,7 +1,12 @@
-from typing import TypedDict, NotRequired, Literal, Any
+from typing import TypedDict, NotRequired, Literal, Any, Iterator
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import time
 from functions.logger import log
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
+from functions.metrics import metrics
+from functions.serializer import project_records, response_json
 
 class Record(TypedDict):
     id: str
@@ -25,42 +30,66 @@ class Response(TypedDict):
     total: int
     paging: NotRequired[dict[Literal["next"], dict[Literal["after"], str]]]
 
+def fetch_search_page(
+    record_type: str,
+    search_body: SearchBody,
+    PRIVATE_APP_KEY: str,
+) -> Response | None:
+    url = f"{BASE_URL}/crm/v3/objects/{record_type}/search"
+    retry = 0
+    while True:
+        try:
+            response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=search_body)
+            response.raise_for_status()
+            json_response = response_json(response)
+            log(f"Retrieved {record_type}: {len(json_response['results'])}")
+            metrics.record_records(response, len(json_response["results"]))
+            return { **json_response, "results": project_records(json_response["results"], search_body.get("properties") or []) }
+        except requests.exceptions.RequestException as e:
+            if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
+                retry = retry + 1
+                interval = backoff(e.response, retry)
+                log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+                time.sleep(interval)
+            elif retry == 5:
+                log("Max retries reached. Skipping batch.", "warning")
+                return None
+            else:
+                error_msg = e.response.text if e.response is not None and e.response.text else str(e)
+                log(f"Error retrieving {record_type}: {error_msg}", "error")
+                return None
+
+def iter_search_pages(
+    record_type: str,
+    search_body: SearchBody,
+    PRIVATE_APP_KEY: str,
+) -> Iterator[list[Record]]:
+    # Requests the next page as soon as its cursor is known, so it downloads while the caller works on this one
+    body: SearchBody = { **search_body }
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(fetch_search_page, record_type, body, PRIVATE_APP_KEY)
+        while next_page is not None:
+            page = next_page.result()
+            if not page:
+                return
+            after = ((page.get("paging") or {}).get("next") or {}).get("after")
+            next_page = None
+            if after:
+                body = { **body, "after": after }
+                next_page = executor.submit(fetch_search_page, record_type, body, PRIVATE_APP_KEY)
+            yield page["results"]
+
+def iter_search_records(
+    record_type: str,
+    search_body: SearchBody,
+    PRIVATE_APP_KEY: str,
+) -> Iterator[Record]:
+    for page in iter_search_pages(record_type, search_body, PRIVATE_APP_KEY):
+        yield from page
+
 def search_records(
     record_type: str,
     search_body: SearchBody,
     PRIVATE_APP_KEY: str,
-    records: list[Record] | None = None,
-    retry: int = 0
 ) -> list[Record]:
-    if records is None:
-        records = []
-    url = f"https://api.hubapi.com/crm/v3/objects/{record_type}/search"
-    headers = { "Authorization": f"Bearer {PRIVATE_APP_KEY}", "Content-Type": "application/json"}
-    try:
-        response = requests.post(url, headers=headers, json=search_body)
-        response.raise_for_status()
-        json_response = response.json()
-        records.extend(json_response["results"])
-        log(f"Retrieved {record_type}: {len(json_response['results'])}")
-        paging = json_response.get("paging")
-        if paging:
-            next = paging.get("next")
-            if next:
-                new_after = next.get("after")
-                if new_after:
-                    search_body["after"] = new_after
-                    search_records(record_type, search_body, PRIVATE_APP_KEY, records, 0)
-    except requests.exceptions.RequestException as e:
-        if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
-            retry = retry + 1
-            interval = retry * 2
-            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
-            time.sleep(interval)
-            search_records(record_type, search_body, PRIVATE_APP_KEY, records, retry)
-        elif retry == 5:
-            log("Max retries reached. Skipping batch.")
-        else:
-            error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-            log(f"Error retrieving {record_type}: {error_msg}")    
-
-    return records
\ No newline at end of file
+    return list(iter_search_records(record_type, search_body, PRIVATE_APP_KEY))
@@ -0,0 +1,41 @@
+import json
+import os
+from typing import Any
+import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson when it's installed, the standard library otherwise. JSON_BACKEND=json forces the standard library.
+BACKEND = "orjson" if orjson is not None and (os.getenv("JSON_BACKEND") or "orjson") == "orjson" else "json"
+
+def dumps(data: Any) -> bytes:
+    if BACKEND == "orjson":
+        return orjson.dumps(data)
+    # Compact separators trim the payload; ensure_ascii stays on because the C encoder is twice as slow without it
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+def loads(content: bytes | str) -> Any:
+    if BACKEND == "orjson":
+        return orjson.loads(content)
+    return json.loads(content)
+
+def response_json(response: requests.Response) -> Any:
+    try:
+        return loads(response.content)
+    except ValueError as e:
+        # Raised as a requests error so the helpers' existing error handling covers it
+        raise requests.exceptions.InvalidJSONError(f"Invalid JSON in response: {e}", response=response) from e
+
+def project_records(records: list[dict], properties: list[str]) -> list[dict]:
+    # Keeps only what the scripts read from a record, so large property values aren't held in memory
+    projected = []
+    for record in records:
+        record_properties = record.get("properties") or {}
+        slim = { "id": record["id"], "properties": { name: record_properties.get(name) for name in properties if name in record_properties } }
+        if "new" in record:
+            slim["new"] = record["new"]
+        projected.append(slim)
+    return projected
@@ -0,0 +1,74 @@
+import argparse
+import csv
+import os
+import zlib
+from pathlib import Path
+from functions.logger import log
+from functions.parse_csv import read_blocks, resolve_csv_path
+from functions.rate_limiter import set_rate_share
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+def parse_shard(value: str) -> tuple[int, int]:
+    # "2/4" is the second of four shards
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a shard like 2/4, got {value}")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {value} is out of range")
+    return index, count
+
+def shard_suffix(shard: tuple[int, int] | None) -> str:
+    return f"_shard{shard[0]}of{shard[1]}" if shard else ""
+
+def apply_shard(shard: tuple[int, int] | None):
+    # Every shard runs against the same portal, so each one only gets its part of the rate limit
+    if shard:
+        set_rate_share(1 / shard[1])
+        log(f"Running shard {shard[0]}/{shard[1]} with 1/{shard[1]} of the rate limit")
+
+def shard_of(key: str, count: int) -> int:
+    # crc32 rather than hash() so the same key lands in the same shard on every run
+    return zlib.crc32(key.encode("utf-8")) % count + 1
+
+def shard_file_names(source_file_name: str, count: int) -> list[str]:
+    # Relative to data/, like the source file name the scripts take
+    stem = Path(source_file_name).stem
+    return [f"shards/{stem}_{index}of{count}.csv" for index in range(1, count + 1)]
+
+def split_csv(source_file_name: str, count: int, mode: str = "hash", key_field: str = "Id") -> list[str]:
+    # hash keeps every external ID in the same shard across runs, so journals still line up on --resume.
+    # range cuts the file into contiguous blocks without parsing it, which is faster but depends on row order.
+    source_path = resolve_csv_path(f"data/{source_file_name}")
+    names = shard_file_names(source_file_name, count)
+    paths = [resolve_csv_path(f"data/{name}") for name in names]
+    paths[0].parent.mkdir(parents=True, exist_ok=True)
+    outputs = [open(path, "w", encoding="utf-8", newline="") for path in paths]
+    try:
+        with open(source_path, "r", encoding="utf-8", newline="") as source:
+            if mode == "range":
+                header = source.readline()
+                for output in outputs:
+                    output.write(header)
+                total = max(os.path.getsize(source_path), 1)
+                # Small blocks relative to the shards keep the shards close to the same size
+                block_size = max(min(BLOCK_SIZE, total // (count * 16)), 64 * 1024)
+                written = 0
+                for block in read_blocks(source, block_size):
+                    outputs[min(written * count // total, count - 1)].write(block)
+                    written += len(block.encode("utf-8"))
+            else:
+                reader = csv.reader(source)
+                header = next(reader)
+                key_index = header.index(key_field)
+                writers = [csv.writer(output, quoting=csv.QUOTE_ALL) for output in outputs]
+                for writer in writers:
+                    writer.writerow(header)
+                for row in reader:
+                    writers[shard_of(row[key_index], count) - 1].writerow(row)
+    finally:
+        for output in outputs:
+            output.close()
+    log(f"Split {source_file_name} into {count} shards by {mode}")
+    return names
@@ -0,0 +1,164 @@
+import csv
+import io
+import multiprocessing
+import re
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable, TypedDict
+from functions.logger import log
+from functions.parse_csv import read_blocks
+
+class ColumnMapping(TypedDict):
+    source: str
+    target: str
+    transform: str
+
+TRUE_VALUES = { "true", "t", "yes", "y", "1" }
+FALSE_VALUES = { "false", "f", "no", "n", "0" }
+DATE_FORMATS = ("%m/%d/%Y", "%m/%d/%Y %H:%M", "%m/%d/%Y %I:%M %p", "%d.%m.%Y")
+BLOCK_SIZE = 4 * 1024 * 1024
+# 1,234,567.89 - commas only between groups of three digits
+THOUSANDS_SEPARATED = re.compile(r"[-+]?\d{1,3}(,\d{3})+(\.\d+)?")
+
+def parse_datetime(value: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+# Values that can't be parsed are passed through unchanged so HubSpot reports them instead of them silently going blank.
+# Exports repeat the same dates a lot, so the formatted results are cached.
+@lru_cache(maxsize=65536)
+def to_date(value: str) -> str:
+    parsed = parse_datetime(value.strip()) if value else None
+    return parsed.date().isoformat() if parsed else value
+
+@lru_cache(maxsize=65536)
+def to_datetime(value: str) -> str:
+    parsed = parse_datetime(value.strip()) if value else None
+    if not parsed:
+        return value
+    # Exports without an offset are taken to be UTC
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None).isoformat(timespec="milliseconds") + "Z"
+
+def to_boolean(value: str) -> str:
+    normalized = value.strip().lower()
+    if normalized in TRUE_VALUES:
+        return "true"
+    if normalized in FALSE_VALUES:
+        return "false"
+    return value
+
+def to_number(value: str) -> str:
+    number = value.strip().replace("$", "")
+    if "," not in number:
+        return number
+    # Any other comma, like the decimal comma in 1,5, is passed through rather than dropped to make 15
+    return number.replace(",", "") if THOUSANDS_SEPARATED.fullmatch(number) else value
+
+TRANSFORMS: dict[str, Callable[[str], str]] = {
+    "date": to_date,
+    "datetime": to_datetime,
+    "boolean": to_boolean,
+    "number": to_number,
+    "strip": str.strip,
+}
+
+def load_mapping(rows: Iterable[dict], source_column: str, target_column: str, transform_column: str) -> list[ColumnMapping]:
+    mappings: list[ColumnMapping] = []
+    for row in rows:
+        source = (row.get(source_column) or "").strip()
+        target = (row.get(target_column) or "").strip()
+        # Rows without a HubSpot name mark export columns that aren't migrated
+        if not source or not target:
+            continue
+        transform = (row.get(transform_column) or "").strip().lower()
+        if transform and transform not in TRANSFORMS:
+            log(f"Unknown transform {transform} for {source}, copying values unchanged", "warning")
+            transform = ""
+        mappings.append({ "source": source, "target": target, "transform": transform })
+    return mappings
+
+class TransformPlan:
+    # Resolves the mapping against the export header once, then transforms whole chunks column by column
+    def __init__(self, header: list[str], mappings: list[ColumnMapping]):
+        positions = { name: i for i, name in enumerate(header) }
+        self.width = len(header)
+        self.header: list[str] = []
+        self.columns: list[tuple[int, Callable[[str], str] | None]] = []
+        for mapping in mappings:
+            if mapping["source"] not in positions:
+                log(f"Column {mapping['source']} is in the mapping but not in the export", "warning")
+                continue
+            self.header.append(mapping["target"])
+            self.columns.append((positions[mapping["source"]], TRANSFORMS.get(mapping["transform"])))
+        mapped = { mapping["source"] for mapping in mappings }
+        unmapped = [name for name in header if name not in mapped]
+        if unmapped:
+            log(f"Dropping {len(unmapped)} unmapped columns: {', '.join(unmapped)}")
+
+    def apply(self, rows: list[list[str]]) -> list[tuple[str, ...]]:
+        if not rows:
+            return []
+        # Short or long rows would misalign the transposed columns
+        rows = [row if len(row) == self.width else (row + [""] * self.width)[:self.width] for row in rows]
+        columns = list(zip(*rows))
+        transformed = [columns[i] if fn is None else list(map(fn, columns[i])) for i, fn in self.columns]
+        return list(zip(*transformed))
+
+def transform_block(plan: TransformPlan, block: str) -> tuple[int, str]:
+    rows = [row for row in csv.reader(io.StringIO(block)) if row]
+    output = io.StringIO()
+    csv.writer(output, quoting=csv.QUOTE_ALL).writerows(plan.apply(rows))
+    return len(rows), output.getvalue()
+
+worker_plan: TransformPlan | None = None
+
+def _init_worker(plan: TransformPlan):
+    global worker_plan
+    worker_plan = plan
+
+def _transform_block(block: str) -> tuple[int, str]:
+    return transform_block(worker_plan, block)
+
+def transform_csv(source_path: Path, output_path: Path, mappings: list[ColumnMapping], processes: int = 1, block_size: int = BLOCK_SIZE) -> int:
+    # Parsing, transforming and formatting all happen on the worker processes; this process only moves
+    # raw text, keeping at most processes * 2 blocks in flight so memory stays flat
+    with open(source_path, "r", encoding="utf-8", newline="") as source:
+        header = next(csv.reader(source), None)
+        if header is None:
+            return 0
+        plan = TransformPlan(header, mappings)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        count = 0
+        with open(output_path, "w", encoding="utf-8", newline="") as output:
+            csv.writer(output, quoting=csv.QUOTE_ALL).writerow(plan.header)
+            if processes <= 1:
+                for block in read_blocks(source, block_size):
+                    rows, text = transform_block(plan, block)
+                    output.write(text)
+                    count += rows
+                return count
+            with multiprocessing.Pool(processes, _init_worker, (plan,)) as pool:
+                pending = deque()
+                for block in read_blocks(source, block_size):
+                    pending.append(pool.apply_async(_transform_block, (block,)))
+                    while len(pending) >= processes * 2 or (pending and pending[0].ready()):
+                        rows, text = pending.popleft().get()
+                        output.write(text)
+                        count += rows
+                while pending:
+                    rows, text = pending.popleft().get()
+                    output.write(text)
+                    count += rows
+        return count
@@ -0,0 +1,115 @@
+import io
+import json
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, TypedDict
+import requests
+from functions.logger import log
+from functions.hubspot_client import BASE_URL, hubspot_request
+from functions.rate_limiter import backoff
+from functions.metrics import metrics
+
+class LocalFile(TypedDict):
+    path: Path
+    name: str
+
+class MultipartFileBody:
+    # multipart/form-data body that reads the file from disk while it is sent instead of buffering it
+    def __init__(self, fields: dict[str, str], file_field: str, file_name: str, path: Path):
+        boundary = uuid.uuid4().hex
+        quoted_name = file_name.replace('"', "%22")
+        mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{quoted_name}"\r\nContent-Type: {mime_type}\r\n\r\n'
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.file_size = os.path.getsize(path)
+        self.length = len(head.encode()) + self.file_size + len(tail)
+        self.file = open(path, "rb")
+        self.parts = [io.BytesIO(head.encode()), self.file, io.BytesIO(tail)]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        while chunk := self.read(1024 * 1024):
+            yield chunk
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self.parts and (size < 0 or size > 0):
+            chunk = self.parts[0].read(size)
+            if not chunk:
+                self.parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self.file.close()
+
+class UploadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, size: int):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        return f"{self.files} files, {self.bytes / 1_000_000:.1f} MB ({self.files / elapsed:.2f} files/s, {self.bytes / elapsed / 1_000_000:.2f} MB/s)"
+
+def upload_file(
+    file: LocalFile,
+    folder_id: str,
+    PRIVATE_APP_KEY: str,
+    stats: UploadStats | None = None,
+) -> str | None:
+    url = f"{BASE_URL}/files/v3/files"
+    fields = {
+        "fileName": file["name"],
+        "folderId": folder_id,
+        "options": json.dumps({ "access": "PRIVATE" }),
+    }
+    retry = 0
+    while True:
+        # A fresh body per attempt, since a failed send leaves the file part-read
+        body = MultipartFileBody(fields, "file", file["name"], file["path"])
+        try:
+            response = hubspot_request("POST", url, PRIVATE_APP_KEY, data=body, headers={ "Content-Type": body.content_type })
+            response.raise_for_status()
+            response_json = response.json()
+            log(f"Uploaded file {response_json.get('name')}")
+            metrics.record_records(response, 1)
+            if stats:
+                stats.add(body.file_size)
+            return response_json.get("id")
+        except requests.exceptions.RequestException as e:
+            if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
+                retry = retry + 1
+                interval = backoff(e.response, retry)
+                log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
+                time.sleep(interval)
+            elif retry == 5:
+                log(f"Max retries reached. Skipping file {file.get('name')}.", "warning")
+                return None
+            else:
+                error_msg = e.response.text if e.response is not None and e.response.text else str(e)
+                log(f"Error uploading file {file.get('name')}: {error_msg}", "error")
+                return None
+        finally:
+            body.close()
@@ -1,16 +1,28 @@
 import csv
 from datetime import datetime
 from pathlib import Path
+from typing import Iterable
 from functions.logger import log
 
-def write_to_csv(title, data):
+def csv_output_path(title) -> Path:
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     project_root = Path(__file__).parent.parent.parent
-    csv_filename = project_root / "logs" / f"{title}_{timestamp}.csv"
-    fieldnames = data[0].keys() if data and len(data) > 0 else []
-    if data and len(data) > 0:
-        with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
-            writer.writerows(data)
-        log(f"Exported {len(data)} {title} to {csv_filename}")
\ No newline at end of file
+    return project_root / "logs" / f"{title}_{timestamp}.csv"
+
+def write_to_csv(title, data: Iterable[dict]):
+    # Rows are written as they're produced, so data can be a generator over a file of any size
+    rows = iter(data)
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    csv_filename = csv_output_path(title)
+    csv_filename.parent.mkdir(parents=True, exist_ok=True)
+    count = 1
+    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=first_row.keys(), quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerow(first_row)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    log(f"Exported {count} {title} to {csv_filename}")
\ No newline at end of file
@@ -1,41 +1,60 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+import argparse
 import requests
 import time
 import sys
 from functions.parse_csv import parse_csv
 from functions.logger import log, output_logs
-from functions.search_records import SearchBody, search_records
+from functions.hubspot_client import BASE_URL, hubspot_request, pool_stats
+from functions.rate_limiter import backoff
+from functions.id_index import IdIndex
+from functions.resolve_ids import resolve_ids
+from functions.journal import Journal
+from functions.upload_file import LocalFile, UploadStats, upload_file
+from functions.run_batches import run_batches
+from functions.file_dedup import FileDedup
+from functions.metrics import metrics, output_metrics
+from functions.reconciliation import Reconciliation
 
 load_dotenv()
 PRIVATE_APP_KEY = os.getenv("PRIVATE_APP_KEY")
 DEAL_EXT_ID = os.getenv("DEAL_EXT_ID")
 CONTACT_EXT_ID = os.getenv("CONTACT_EXT_ID")
 COMPANY_EXT_ID = os.getenv("COMPANY_EXT_ID")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS") or 4)
 if not PRIVATE_APP_KEY or not CONTACT_EXT_ID or not COMPANY_EXT_ID or not DEAL_EXT_ID:
-    log("Error: Missing required environment variable(s).")
+    log("Error: Missing required environment variable(s).", "error")
     sys.exit()
-hs_headers = { "Authorization": f"Bearer {PRIVATE_APP_KEY}" }
 
-object_type = sys.argv[1] if len(sys.argv) > 1 else None
+parser = argparse.ArgumentParser(description="Upload files as note attachments on HubSpot records")
+parser.add_argument("object_type", nargs="?", default=None, help="deals, contacts or companies")
+parser.add_argument("--resume", action="store_true", help="skip folders, files and notes created by a previous run")
+parser.add_argument("--no-dedup", action="store_true", help="upload every file even if identical content was uploaded before")
+args = parser.parse_args()
+object_type = args.object_type
 if not object_type:
-    log("Error: Object type not provided as argument.")
+    log("Error: Object type not provided as argument.", "error")
     sys.exit()
 
 assoc_type_id = 0
 if object_type == "deal" or object_type == "deals":
     assoc_type_id = 214
     object_type = "deals"
+    ext_id_property = DEAL_EXT_ID
 elif object_type == "contact" or object_type == "contacts": 
     assoc_type_id = 203
     object_type = "contacts"
+    ext_id_property = CONTACT_EXT_ID
 elif object_type == "company" or object_type == "companies":
     assoc_type_id = 204
     object_type = "companies"
+    ext_id_property = COMPANY_EXT_ID
 else:
-    log("Error: Invalid object type provided. Must be one of 'deals', 'contacts', or 'companies'.")
+    log("Error: Invalid object type provided. Must be one of 'deals', 'contacts', or 'companies'.", "error")
     sys.exit()
+journal = Journal(f"migrate_files_{object_type}", args.resume)
 
 source_dir = Path(__file__).parent.parent / "files" / object_type
 file_dict = {}
@@ -57,8 +76,7 @@ for root, dirs, files in os.walk(source_dir):
         if filename.startswith('.'):
             continue
         
-        path = root_path / filename
-        file = {
+        file: LocalFile = {
             "path": root_path / filename,
             "name": filename,
         }
@@ -71,144 +89,156 @@ log(f"Total opportunities with files: {len(file_dict.keys())}")
 log(f"Total files to migrate: {sum(len(v) for v in file_dict.values())}")
 
 # Get Record IDs
-records = []
-for i in range(0, len(folder_names), 100):
-    batch = folder_names[i:i+100]
-    search_body: SearchBody = {
-        "filterGroups": [
-            {
-                "filters": [
-                    {
-                        "propertyName": DEAL_EXT_ID,
-                        "operator": "IN",
-                        "values": batch
-                    }
-                ]
-            }
-        ],
-        "properties": [DEAL_EXT_ID],
-        "limit": 100
-    }
-    records.append(search_records(object_type, search_body, PRIVATE_APP_KEY))
-    time.sleep(0.25)
-log(f"Total records found: {len(records)}")
+id_index = IdIndex()
+resolve_ids(object_type, ext_id_property, folder_names, PRIVATE_APP_KEY, id_index)
+log(f"Total records found: {id_index.count(object_type)}")
         
 # Create Folders in HubSpot File Manager
 def create_folder(name, retry):
-    url = f"https://api.hubapi.com/files/v3/folders"
+    url = f"{BASE_URL}/files/v3/folders"
     data = {
         "name": name,
         "parentPath": f"/Migrated Files/{object_type}",
     }
     try:
-        response = requests.post(url, headers=hs_headers, json=data)
+        response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=data)
         response.raise_for_status()
         response_json = response.json()
         log(f"Created folder {response_json.get("name")}")
+        metrics.record_records(response, 1)
         return response_json.get("id")
     except requests.exceptions.RequestException as e:
         if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
             retry = retry + 1
-            interval = retry * 2
-            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
-            time.sleep(interval)
-            create_folder(name, retry)
-        elif retry == 5:
-            log(f"Max retries reached. Skipping folder {name}.")
-        else:
-            error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-            log(f"Error creating folder {name}: {error_msg}")
-
-# Upload Files
-hs_files = []
-def upload_file(file, folder_id, retry):
-    url = f"https://api.hubapi.com/files/v3/files"
-    files = { "file": (file["name"], open(file["path"], "rb")) }
-    data = {
-        "fileName": file["name"],
-        "folderId": folder_id,
-        "options": '{ "access": "PRIVATE" }',
-    }
-    try:
-        with open(file["path"], "rb") as f:
-            files = { "file": (file["name"], f) }
-            response = requests.post(url, headers=hs_headers, data=data, files=files)
-            response.raise_for_status()
-            response_json = response.json()
-            log(f"Uploaded file {response_json.get("name")}")
-            hs_files.append(response_json)
-            return response_json.get("id")
-    except requests.exceptions.RequestException as e:
-        if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
-            retry = retry + 1
-            interval = retry * 2
-            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
+            interval = backoff(e.response, retry)
+            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
             time.sleep(interval)
-            upload_file(file, folder_id, retry)
+            return create_folder(name, retry)
         elif retry == 5:
-            log(f"Max retries reached. Skipping file {file.get("name")}.")
+            log(f"Max retries reached. Skipping folder {name}.", "warning")
         else:
             error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-            log(f"Error uploading file {file.get("name")}: {error_msg}")
-
-note_inputs = []
-for i, folder_name in enumerate(folder_names):
-    log(f"\n\nPROCESSING FOLDER {i + 1}/{len(folder_names)}")
-    folder_id = create_folder(folder_name, 0)
-    time.sleep(0.25)
-    file_ids = []
-    for file in file_dict[folder_name]:
-        file_id = upload_file(file, folder_id, 0)
-        file_ids.append(file_id)
-        time.sleep(0.25)
-    log(f"Total files uploaded: {len(hs_files)}")
-    record_id = next((record["id"] for record in records if record["properties"].get(DEAL_EXT_ID) == folder_name), None)
-    if record_id:
-        note_input = {
-            "properties": {
-                "hs_note_body": f"Migrated files for {object_type} {folder_name}",
-                "hs_attachment_ids": ";".join(file_ids)
-            },
-            "associations": [{
-                "to": { "id": record_id },
-                "types": [{
-                    "associationCategory": "HUBSPOT_DEFINED",
-                    "associationTypeId": assoc_type_id
-                }]
-            }]
-        }
-        note_inputs.append(note_input)
-    else:
-        log(f"No Record ID found for {folder_name}")
+            log(f"Error creating folder {name}: {error_msg}", "error")
 
 # Create Notes
 notes = []
 def create_notes(batch, retry):
-    url = "https://api.hubapi.com/crm/v3/objects/notes/batch/create"
+    url = f"{BASE_URL}/crm/v3/objects/notes/batch/create"
     data = { "inputs": batch }
     try:
-        response = requests.post(url, headers=hs_headers, json=data)
+        response = hubspot_request("POST", url, PRIVATE_APP_KEY, json=data)
         response.raise_for_status()
         response_json = response.json()
         these_notes = response_json.get("results")
         log(f"Created Notes: {len(these_notes)}")
+        metrics.record_records(response, len(these_notes))
         notes.extend(these_notes)
+        return True
     except requests.exceptions.RequestException as e:
         if e.response is not None and (e.response.status_code == 429 or str(e.response.status_code)[0] == "5") and retry < 5:
             retry = retry + 1
-            interval = retry * 2
-            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...")
+            interval = backoff(e.response, retry)
+            log(f"{'Rate limit exceeded' if e.response.status_code == 429 else 'Server error'}. Retrying after {interval} seconds...", "warning")
             time.sleep(interval)
-            create_notes(batch, retry)
+            return create_notes(batch, retry)
         elif retry == 5:
-            log("Max retries reached. Skipping batch.")
+            log("Max retries reached. Skipping batch.", "warning")
         else:
             error_msg = e.response.text if e.response is not None and e.response.text else str(e)
-            log(f"Error creating Notes: {error_msg}")
-for i in range(0, len(note_inputs), 100):
-    batch = note_inputs[i:i+100]
-    create_notes(batch, 0)
-    time.sleep(0.25)
+            log(f"Error creating Notes: {error_msg}", "error")
+        return False
+
+# Upload Files
+upload_stats = UploadStats()
+file_dedup = None if args.no_dedup else FileDedup()
+def migrate_folder(folder_name):
+    # Returns an error instead of the file IDs if the folder or any file failed, so the note isn't created with
+    # attachments missing and --resume retries the folder
+    folder_id = journal.get("folder", folder_name)
+    if not folder_id:
+        folder_id = create_folder(folder_name, 0)
+        if not folder_id:
+            return folder_name, [], "Folder creation failed"
+        journal.record("folder", folder_name, folder_id)
+    file_ids = []
+    failed_files = 0
+    for file in file_dict[folder_name]:
+        file_id = journal.get("file", str(file["path"]))
+        if not file_id:
+            if file_dedup:
+                file_id = file_dedup.get_or_upload(file, lambda: upload_file(file, folder_id, PRIVATE_APP_KEY, upload_stats))
+            else:
+                file_id = upload_file(file, folder_id, PRIVATE_APP_KEY, upload_stats)
+            if file_id:
+                journal.record("file", str(file["path"]), file_id)
+        if file_id:
+            file_ids.append(file_id)
+        else:
+            failed_files += 1
+    log(f"Uploaded so far: {upload_stats.summary()}")
+    if failed_files:
+        return folder_name, file_ids, f"{failed_files} of {len(file_dict[folder_name])} file uploads failed"
+    return folder_name, file_ids, None
+
+# Create folders and upload files on UPLOAD_WORKERS threads while notes are created as folders finish
+report = Reconciliation("migrate_files")
+pending_folders = []
+for folder_name in folder_names:
+    if journal.done("note", folder_name):
+        log(f"Skipping {folder_name}, note already created")
+        report.add("imported", [folder_name], "Note created by a previous run")
+    elif not id_index.get(object_type, folder_name):
+        log(f"No Record ID found for {folder_name}", "warning")
+        report.add("skipped_no_parent", [folder_name], f"No HubSpot {object_type} found for {folder_name}")
+    else:
+        pending_folders.append(folder_name)
+
+note_inputs = []
+note_folders = []
+def flush_notes():
+    if create_notes(note_inputs, 0):
+        journal.record_many("note", [(folder_name, None) for folder_name in note_folders])
+        report.add("imported", note_folders)
+    else:
+        report.add("failed_in_api", note_folders, "Note creation failed")
+    note_inputs.clear()
+    note_folders.clear()
+
+for i, (folder_name, file_ids, error) in enumerate(run_batches(migrate_folder, pending_folders, UPLOAD_WORKERS)):
+    log(f"\n\nPROCESSED FOLDER {i + 1}/{len(pending_folders)}")
+    if error:
+        log(f"Not creating a note for {folder_name}: {error}", "error")
+        report.add("failed_in_api", [folder_name], error)
+        continue
+    note_input = {
+        "properties": {
+            "hs_note_body": f"Migrated files for {object_type} {folder_name}",
+            "hs_attachment_ids": ";".join(file_ids)
+        },
+        "associations": [{
+            "to": { "id": id_index.get(object_type, folder_name) },
+            "types": [{
+                "associationCategory": "HUBSPOT_DEFINED",
+                "associationTypeId": assoc_type_id
+            }]
+        }]
+    }
+    note_inputs.append(note_input)
+    note_folders.append(folder_name)
+    if len(note_inputs) == 100:
+        flush_notes()
+if note_inputs:
+    flush_notes()
+journal.close()
+
+log(f"Total files uploaded: {upload_stats.summary()}")
+if file_dedup:
+    log(f"Deduplication: {file_dedup.summary()}")
 log(f"Total Notes created: {len(notes)}")
+log(f"HTTP connection pool: {pool_stats()}")
+
+# Write every folder to the report bucket for its outcome
+report.output(lambda: ({ "folder": folder_name, "files": len(file_dict[folder_name]) } for folder_name in folder_names), "folder")
 
+output_metrics("migrate_files_metrics")
 output_logs("migrate_files_log")
\ No newline at end of file
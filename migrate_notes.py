@@ -1,10 +1,20 @@
 from functions.logger import log, output_logs
-from functions.parse_csv import parse_csv
-from functions.search_records import SearchBody, search_records
+from functions.parse_csv import stream_csv, chunked
 from functions.batch_create_records import CreateInput, batch_create_records
-from functions.write_to_csv import write_to_csv
+from functions.associate_records import associate_records
+from functions.reconciliation import Reconciliation, failure_bucket
+from functions.id_index import IdIndex
+from functions.resolve_parents import ParentResolver, ParentType
+from functions.journal import Journal
+from functions.hubspot_client import pool_stats
+from functions.metrics import output_metrics
+from functions.dead_letter import output_dead_letters
+from functions.pipeline import Pipeline
+from functions.shard import apply_shard, parse_shard, shard_suffix
+from functions.delta_sync import DeltaState, DeltaSync
 from dotenv import load_dotenv
-import time
+import argparse
+from pathlib import Path
 import sys
 import os
 
@@ -14,186 +24,169 @@ NOTE_EXT_ID = os.getenv("NOTE_EXT_ID")
 CONTACT_EXT_ID = os.getenv("CONTACT_EXT_ID")
 COMPANY_EXT_ID = os.getenv("COMPANY_EXT_ID")
 DEAL_EXT_ID = os.getenv("DEAL_EXT_ID")
+WORKERS = int(os.getenv("WORKERS") or 1)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE") or 1000)
 if not PRIVATE_APP_KEY or not NOTE_EXT_ID or not CONTACT_EXT_ID or not COMPANY_EXT_ID or not DEAL_EXT_ID:
-    log("Error: Missing required environment variable(s).")
+    log("Error: Missing required environment variable(s).", "error")
     sys.exit()
 
-source_file_name = sys.argv[1] if len(sys.argv) > 1 else "notes.csv"
+parser = argparse.ArgumentParser(description="Create HubSpot notes from a Salesforce export")
+parser.add_argument("source_file_name", nargs="?", default="notes.csv")
+parser.add_argument("--resume", action="store_true", help="skip notes created by a previous run")
+parser.add_argument("--upsert", action="store_true", help="upsert notes on NOTE_EXT_ID instead of creating them, so re-runs update rather than duplicate")
+parser.add_argument("--delta", action="store_true", help="only send notes that are new or changed since the last --delta run, upserting them on NOTE_EXT_ID")
+parser.add_argument("--shard", type=parse_shard, help="run as shard i/N of a sharded run (see run_sharded.py), with 1/N of the rate limit")
+args = parser.parse_args()
+source_file_name = args.source_file_name
 if not source_file_name:
-    log("Error: Source file name not provided as argument.")
+    log("Error: Source file name not provided as argument.", "error")
     sys.exit()
 
-notes: list[dict] = parse_csv(f"data/{source_file_name}")
-
-# Get Contacts to associate
-contact_ext_ids: list[str] = []
-for note in notes:
-    # Specific to Salesforce, modify as needed
-    if note.get("ParentId") and note["ParentId"][:3] == "003":
-        contact_ext_ids.append(note["ParentId"])
-contact_ext_ids = list(set(contact_ext_ids))
-
-contacts = []
-for i in range(0, len(contact_ext_ids), 100):
-    log(f"batch {i//100 + 1}/{len(contact_ext_ids)//100 + 1}")
-    batch_contact_ext_ids = contact_ext_ids[i:i + 100]
-    if len(batch_contact_ext_ids) == 0:
-        continue
-    contact_search_body: SearchBody = {
-        "filterGroups": [
-            {
-                "filters": [
-                    {
-                        "propertyName": CONTACT_EXT_ID,
-                        "operator": "IN",
-                        "values": batch_contact_ext_ids
-                    }
-                ]
-            }
-        ],
-        "properties": ["hs_object_id", CONTACT_EXT_ID],
-        "limit": 100
-    }
-    contacts.extend(search_records("contacts", contact_search_body, PRIVATE_APP_KEY))
-    time.sleep(0.25)
-
-# Get Companies to associate
-company_ext_ids: list[str] = []
-for note in notes:
-    # Specific to Salesforce, modify as needed
-    if note.get("ParentId") and note["ParentId"][:3] == "001":
-        company_ext_ids.append(note["ParentId"])
-company_ext_ids = list(set(company_ext_ids))
-
-companies = []
-for i in range(0, len(company_ext_ids), 100):
-    log(f"batch {i//100 + 1}/{len(company_ext_ids)//100 + 1}")
-    batch_company_ext_ids = company_ext_ids[i:i + 100]
-    if len(batch_company_ext_ids) == 0:
-        continue
-    company_search_body: SearchBody = {
-        "filterGroups": [
-            {
-                "filters": [
-                    {
-                        "propertyName": COMPANY_EXT_ID,
-                        "operator": "IN",
-                        "values": batch_company_ext_ids
-                    }
-                ]
-            }
-        ],
-        "properties": ["hs_object_id", COMPANY_EXT_ID],
-        "limit": 100
-    }
-    companies.extend(search_records("companies", company_search_body, PRIVATE_APP_KEY))
-    time.sleep(0.25)
-
-# Get Deals to associate
-deal_ext_ids: list[str] = []
-for note in notes:
-    # Specific to Salesforce, modify as needed
-    if note.get("ParentId") and note["ParentId"][:3] == "006":
-        deal_ext_ids.append(note["ParentId"])
-deal_ext_ids = list(set(deal_ext_ids))
-
-deals = []
-for i in range(0, len(deal_ext_ids), 100):
-    log(f"batch {i//100 + 1}/{len(deal_ext_ids)//100 + 1}")
-    batch_deal_ext_ids = deal_ext_ids[i:i + 100]
-    if len(batch_deal_ext_ids) == 0:
-        continue
-    deal_search_body: SearchBody = {
-        "filterGroups": [
-            {
-                "filters": [
-                    {
-                        "propertyName": DEAL_EXT_ID,
-                        "operator": "IN",
-                        "values": batch_deal_ext_ids
-                    }
-                ]
-            }
-        ],
-        "properties": ["hs_object_id", DEAL_EXT_ID],
-        "limit": 100
-    }
-    deals.extend(search_records("deals", deal_search_body, PRIVATE_APP_KEY))
-    time.sleep(0.25)
-
-# Create Notes
-inputs: list[CreateInput] = []
-for note in notes:
-
-    # Specific to Salesforce, modify as needed
-    properties = {
-        NOTE_EXT_ID: note["Id"],
-        "hs_note_body": note.get("Body") or note.get("CommentBody") or "",
-        "hs_timestamp": note["CreatedDate"].replace("+0000", "Z"),
-    }
-
-    associations = []
-    # Add Contact association
-    if note.get("ParentId") and note["ParentId"][:3] == "003": # Specific to Salesforce, modify as needed
-        contact_ids: list[str] = [contact["id"] for contact in contacts if contact["properties"].get(CONTACT_EXT_ID) == note["ParentId"]]
-        if len(contact_ids):
-            associations.append({
-                "types": [
-                    {
-                        "associationCategory": "HUBSPOT_DEFINED",
-                        "associationTypeId": 202
-                    }
-                ],
-                "to": {
-                    "id": contact_ids[0]
-                }
-            })
-
-    # Add Company association
-    if note.get("ParentId") and note["ParentId"][:3] == "001": # Specific to Salesforce, modify as needed
-        company_ids: list[str] = [company["id"] for company in companies if company["properties"].get(COMPANY_EXT_ID) == note["ParentId"]]
-        if len(company_ids):
-            associations.append({
-                "types": [
-                    {
-                        "associationCategory": "HUBSPOT_DEFINED",
-                        "associationTypeId": 190
-                    }
-                ],
-                "to": {
-                    "id": company_ids[0]
-                }
-            })
-
-    # Add Deal association
-    if note.get("ParentId") and note["ParentId"][:3] == "006": # Specific to Salesforce, modify as needed
-        deal_ids: list[str] = [deal["id"] for deal in deals if deal["properties"].get(DEAL_EXT_ID) == note["ParentId"]]
-        if len(deal_ids):
-            associations.append({
-                "types": [
-                    {
-                        "associationCategory": "HUBSPOT_DEFINED",
-                        "associationTypeId": 214
-                    }
-                ],
-                "to": {
-                    "id": deal_ids[0]
-                }
-            })
-
-    if len(associations):
-        input: CreateInput = {
-            "properties": properties,
-            "associations": associations
+id_index = IdIndex()
+apply_shard(args.shard)
+journal = Journal(f"migrate_notes_{Path(source_file_name).name}", args.resume)
+if args.resume:
+    log(f"Resuming: {journal.count('note')} notes already created")
+
+# Specific to Salesforce, modify as needed
+MODIFIED_FIELD = "LastModifiedDate"
+delta = None
+if args.delta:
+    # Changed notes already exist in HubSpot, so they're updated in place
+    args.upsert = True
+    delta = DeltaSync(DeltaState(), "notes", "Id", MODIFIED_FIELD, None, f"notes{shard_suffix(args.shard)}")
+
+# Salesforce ID prefix -> HubSpot parent the note is associated to. Specific to Salesforce, modify as needed,
+# e.g. add "500" for tickets or "00T" for tasks
+NOTE_PARENT_TYPES: dict[str, ParentType] = {
+    "003": { "object_type": "contacts", "id_property": CONTACT_EXT_ID, "association_type_id": 202 },
+    "001": { "object_type": "companies", "id_property": COMPANY_EXT_ID, "association_type_id": 190 },
+    "006": { "object_type": "deals", "id_property": DEAL_EXT_ID, "association_type_id": 214 },
+}
+parents = ParentResolver(NOTE_PARENT_TYPES, PRIVATE_APP_KEY, id_index)
+
+# Resolve parents for one chunk while the previous chunk's notes are being created
+def resolve_parents(notes: list[dict]) -> list[dict]:
+    parents.resolve(note.get("ParentId") for note in notes)
+    return notes
+
+def build_inputs(notes: list[dict]) -> tuple[list[dict], list[CreateInput]]:
+    inputs: list[CreateInput] = []
+    for note in notes:
+
+        # Specific to Salesforce, modify as needed
+        properties = {
+            NOTE_EXT_ID: note["Id"],
+            "hs_note_body": note.get("Body") or note.get("CommentBody") or "",
+            "hs_timestamp": note["CreatedDate"].replace("+0000", "Z"),
         }
-        inputs.append(input)
-
-log(f"Total notes to create: {len(inputs)}")
 
-batch_create_records("notes", inputs, PRIVATE_APP_KEY)
-
-# Write non-imported notes to CSV
-non_imported_notes = [note for note in notes if note["Id"] not in [input["properties"][NOTE_EXT_ID] for input in inputs]]
-write_to_csv("logs/non_imported_notes", non_imported_notes)
-
-output_logs("migrate_notes_log")
\ No newline at end of file
+        association = parents.association(note.get("ParentId"))
+        if association:
+            input: CreateInput = {
+                "properties": properties,
+                "associations": [association]
+            }
+            inputs.append(input)
+        else:
+            report.add("skipped_no_parent", [note["Id"]], parents.missing_reason(note.get("ParentId")))
+
+    log(f"Total notes to create: {len(inputs)}")
+    return notes, inputs
+
+def record_created_notes(batch: list[CreateInput], results: list[dict]):
+    record_done_notes([input["properties"][NOTE_EXT_ID] for input in batch])
+
+def record_done_notes(ext_ids: list[str]):
+    journal.record_many("note", [(ext_id, None) for ext_id in ext_ids])
+    if delta:
+        delta.synced(ext_ids)
+    report.add("imported", ext_ids)
+
+def create_notes(chunk: tuple[list[dict], list[CreateInput]]) -> int:
+    notes, inputs = chunk
+    created = batch_create_records(
+        "notes",
+        inputs,
+        PRIVATE_APP_KEY,
+        WORKERS,
+        # Upserted notes are only done once associate_upserted_notes has associated them
+        None if args.upsert else record_created_notes,
+        NOTE_EXT_ID if args.upsert else None,
+        lambda batch, error, status: report.add(failure_bucket(status), [input["properties"][NOTE_EXT_ID] for input in batch], error)
+    )
+    if args.upsert:
+        associate_upserted_notes(inputs, created)
+    return len(created)
+
+def associate_upserted_notes(inputs: list[CreateInput], records: list[dict]):
+    # Batch upsert drops associations, so they're sent through the associations API instead
+    note_ids = { record["properties"][NOTE_EXT_ID]: record["id"] for record in records if record["properties"].get(NOTE_EXT_ID) }
+    pairs_by_type: dict[int, list[dict]] = {}
+    upserted = []
+    for input in inputs:
+        ext_id = input["properties"][NOTE_EXT_ID]
+        note_id = note_ids.get(ext_id)
+        if not note_id:
+            continue
+        upserted.append(ext_id)
+        for association in input.get("associations", []):
+            for type in association["types"]:
+                pairs_by_type.setdefault(type["associationTypeId"], []).append({ "ext_id": ext_id, "note_id": note_id, "to_id": association["to"]["id"] })
+
+    failed: set[str] = set()
+    def association_failed(batch: list[dict], error: str, status: int | None):
+        failed.update(pair["ext_id"] for pair in batch)
+        report.add(failure_bucket(status), [pair["ext_id"] for pair in batch], f"Association failed: {error}")
+
+    for type_id, pairs in pairs_by_type.items():
+        associate_records(
+            "notes",
+            "note_id",
+            parents.object_types[type_id],
+            "to_id",
+            "HUBSPOT_DEFINED",
+            type_id,
+            pairs,
+            PRIVATE_APP_KEY,
+            WORKERS,
+            None,
+            association_failed
+        )
+    # Notes whose associations failed are left out, so --resume and --delta send them again
+    record_done_notes([ext_id for ext_id in upserted if ext_id not in failed])
+
+# Stream the export in chunks so memory stays bounded by CHUNK_SIZE, not the file size
+total_created = 0
+report = Reconciliation(f"migrate_notes{shard_suffix(args.shard)}")
+def pending_notes():
+    for note in stream_csv(f"data/{source_file_name}"):
+        if journal.done("note", note["Id"]):
+            report.add("imported", [note["Id"]], "Created by a previous run")
+        else:
+            yield note
+
+notes = pending_notes()
+if delta:
+    notes = delta.filter(notes, lambda ext_ids: report.add("imported", ext_ids, "Unchanged since the last sync"))
+pipeline = (
+    Pipeline(chunked(notes, CHUNK_SIZE))
+    .stage("resolve", resolve_parents)
+    .stage("transform", build_inputs)
+    .stage("load", create_notes)
+)
+for created in pipeline.run():
+    total_created += created
+
+journal.close()
+log(f"Notes created across all chunks: {total_created}")
+if delta:
+    delta.commit()
+
+# Write every note to the report bucket for its outcome
+report.output(lambda: stream_csv(f"data/{source_file_name}"), "Id")
+
+log(f"HTTP connection pool: {pool_stats()}")
+output_dead_letters()
+output_metrics(f"migrate_notes_metrics{shard_suffix(args.shard)}")
+output_logs(f"migrate_notes_log{shard_suffix(args.shard)}")
\ No newline at end of file
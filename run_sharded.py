@@ -0,0 +1,89 @@
+from dotenv import load_dotenv
+import argparse
+import csv
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from functions.logger import LOG_DIR, log, output_logs
+from functions.shard import shard_file_names, split_csv
+from functions.reconciliation import BUCKETS
+from functions.write_to_csv import write_to_csv
+
+load_dotenv()
+SCRIPTS = { "migrate_notes": "migrate_notes.py", "assoc_deals": "assoc_deals.py" }
+
+# Anything after the known arguments, like --resume or --upsert, is passed on to every shard
+parser = argparse.ArgumentParser(description="Run a migration script as several processes, each over its own shard of the input CSV")
+parser.add_argument("script", choices=SCRIPTS)
+parser.add_argument("source_file_name")
+parser.add_argument("--shards", type=int, default=os.cpu_count() or 2)
+parser.add_argument("--split", choices=("hash", "range"), default="hash", help="hash of --key (stable across runs) or contiguous row ranges")
+parser.add_argument("--key", default="Id", help="column hashed to pick each row's shard")
+parser.add_argument("--no-split", action="store_true", help="reuse the shard files of a previous run, e.g. with --resume")
+args, script_args = parser.parse_known_args()
+if args.shards < 1:
+    log("Error: --shards must be at least 1.", "error")
+    sys.exit()
+
+started = time.time()
+if args.no_split:
+    shard_names = shard_file_names(args.source_file_name, args.shards)
+else:
+    shard_names = split_csv(args.source_file_name, args.shards, args.split, args.key)
+
+# Each shard logs to its own files, which are merged below, so their console output isn't interleaved here
+processes = []
+for index, shard_name in enumerate(shard_names, 1):
+    command = [sys.executable, SCRIPTS[args.script], shard_name, "--shard", f"{index}/{args.shards}", *script_args]
+    log(f"Starting shard {index}/{args.shards}: {' '.join(command[1:])}")
+    processes.append(subprocess.Popen(command, cwd=Path(__file__).parent, stdout=subprocess.DEVNULL))
+
+failed_shards = []
+for index, process in enumerate(processes, 1):
+    if process.wait() != 0:
+        failed_shards.append(index)
+        log(f"Shard {index}/{args.shards} exited with code {process.returncode}", "error")
+log(f"All {args.shards} shards finished in {time.time() - started:.1f}s")
+
+def shard_outputs(directory: Path, pattern: str) -> list[Path]:
+    # Only files written by this run
+    return sorted(path for path in directory.glob(pattern) if path.stat().st_mtime >= started)
+
+def read_log(path: Path):
+    shard = path.name.split("_shard", 1)[1].split("_", 1)[0]
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield record["time"], { **record, "shard": shard }
+
+# Each shard's log is already in time order, so a streaming merge keeps them in order overall
+log_files = shard_outputs(LOG_DIR, f"{args.script}_log_shard*of{args.shards}_*.jsonl")
+merged_log_path = LOG_DIR / f"{args.script}_log_sharded_{datetime.now().isoformat()}.jsonl"
+with open(merged_log_path, "w", encoding="utf-8") as merged_log:
+    for _, record in heapq.merge(*(read_log(path) for path in log_files), key=lambda item: item[0]):
+        merged_log.write(json.dumps(record) + "\n")
+log(f"Merged {len(log_files)} shard logs into {merged_log_path.name}")
+
+def read_rows(paths: list[Path]):
+    for path in paths:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+
+for bucket in BUCKETS:
+    bucket_files = shard_outputs(LOG_DIR / "reconciliation", f"{args.script}_shard*of{args.shards}_{bucket}_*.csv")
+    if bucket_files:
+        write_to_csv(f"reconciliation/{args.script}_{bucket}", read_rows(bucket_files))
+
+if failed_shards:
+    log(f"Shards {', '.join(map(str, failed_shards))} failed, re-run with --no-split --resume to finish them", "error")
+output_logs("run_sharded_log")
+if failed_shards:
+    sys.exit(1)
@@ -1,29 +1,40 @@
-import os
-from dotenv import load_dotenv
-import sys
-from functions.logger import output_logs
-from functions.parse_csv import parse_csv
-from functions.write_to_csv import write_to_csv
-
-load_dotenv()
-SOURCE_COLUMN_NAME = os.getenv("SOURCE_COLUMN_NAME")
-HS_COLUMN_NAME = os.getenv("HS_COLUMN_NAME")
-if not SOURCE_COLUMN_NAME or not HS_COLUMN_NAME:
-    print("Error: Missing required environment variable(s).")
-    sys.exit()
-
-object_name = sys.argv[1] if len(sys.argv) > 1 else None
-if not object_name:
-    print("Error: Object name not provided as argument.")
-    sys.exit()
-    
-mapping = parse_csv(f"mapping/{object_name}")
-data = parse_csv(f"data/{object_name}")
-
-for row in data:
-    if SOURCE_COLUMN_NAME in row:
-        row[HS_COLUMN_NAME] = row.pop(SOURCE_COLUMN_NAME)
-
-write_to_csv(f"transformed/{object_name}", data)
-
-output_logs("transformation_log")
\ No newline at end of file
+import os
+from dotenv import load_dotenv
+import sys
+import time
+from functions.logger import log, output_logs
+from functions.parse_csv import parse_csv, resolve_csv_path
+from functions.write_to_csv import csv_output_path
+from functions.transform_columns import load_mapping, transform_csv
+
+# Worker processes import this module, so the transform only runs in the main process
+if __name__ == "__main__":
+    load_dotenv()
+    SOURCE_COLUMN_NAME = os.getenv("SOURCE_COLUMN_NAME")
+    HS_COLUMN_NAME = os.getenv("HS_COLUMN_NAME")
+    TRANSFORM_COLUMN_NAME = os.getenv("TRANSFORM_COLUMN_NAME") or "Transform"
+    TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS") or 1)
+    if not SOURCE_COLUMN_NAME or not HS_COLUMN_NAME:
+        log("Error: Missing required environment variable(s).", "error")
+        sys.exit()
+
+    object_name = sys.argv[1] if len(sys.argv) > 1 else None
+    if not object_name:
+        log("Error: Object name not provided as argument.", "error")
+        sys.exit()
+
+    # The mapping file has one row per export column: its name, the HubSpot property it maps to and an optional value transform
+    mapping = load_mapping(parse_csv(f"mapping/{object_name}"), SOURCE_COLUMN_NAME, HS_COLUMN_NAME, TRANSFORM_COLUMN_NAME)
+    log(f"Mapping {len(mapping)} columns, {sum(1 for column in mapping if column['transform'])} with value transforms")
+
+    source_path = resolve_csv_path(f"data/{object_name}")
+    if not os.path.exists(source_path):
+        log(f"Error: File not found at {source_path}", "error")
+        sys.exit()
+
+    started = time.monotonic()
+    output_path = csv_output_path(f"transformed/{object_name}")
+    count = transform_csv(source_path, output_path, mapping, TRANSFORM_WORKERS)
+    log(f"Exported {count} transformed/{object_name} to {output_path} in {time.monotonic() - started:.1f}s")
+
+    output_logs("transformation_log")
\ No newline at end of file